@@ -0,0 +1,887 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the human-in-the-loop MCP server
+
+Runs entirely offline (no Discord token needed):
+    python3 benchmark.py transport --messages 20000
+    python3 benchmark.py egress --megabytes 8
+    python3 benchmark.py load --sessions 20 --calls 100
+    python3 benchmark.py startup --runs 10
+    python3 benchmark.py gateway --messages 20000   (needs the real discord.py)
+    python3 benchmark.py rpc --requests 50000 --batch 10
+    python3 benchmark.py recovery --history 20000 --gap 50
+    python3 benchmark.py deadlines --questions 10000
+    python3 benchmark.py logging --records 20000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import discord
+
+import final_working_version as server
+
+
+def percentile(samples, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+# ---------------------------------------------------------------------------
+# transport: stdin framing + stdout responses
+# ---------------------------------------------------------------------------
+
+def _feed_frames(wfile, count: int, payload: str) -> None:
+    """Writer thread playing the MCP client: every ping at once (open loop, throughput)"""
+    for i in range(count):
+        frame = {"jsonrpc": "2.0", "id": i, "method": "ping", "params": {"pad": payload}}
+        wfile.write(json.dumps(frame).encode("utf-8") + b"\n")
+    wfile.flush()
+    wfile.close()
+
+
+def _ping_pong(wfile, rfile, count: int, payload: str, latencies) -> None:
+    """Client thread sending one ping and waiting for its response (closed loop, latency)"""
+    for i in range(count):
+        frame = {"jsonrpc": "2.0", "id": i, "method": "ping", "params": {"pad": payload}}
+        started = time.perf_counter()
+        wfile.write(json.dumps(frame).encode("utf-8") + b"\n")
+        wfile.flush()
+        if not rfile.readline():
+            break
+        latencies.append(time.perf_counter() - started)
+    wfile.close()
+    while rfile.read(65536):
+        pass
+
+
+def _drain(rfile) -> None:
+    """Reader thread playing the MCP client reading responses"""
+    while rfile.read(65536):
+        pass
+
+
+def _pipes():
+    in_r, in_w = os.pipe()
+    out_r, out_w = os.pipe()
+    return (os.fdopen(in_r, "rb", buffering=0), os.fdopen(in_w, "wb"),
+            os.fdopen(out_r, "rb"), os.fdopen(out_w, "w"))
+
+
+async def _legacy_loop(stdin, stdout, count: int) -> None:
+    """The pre-transport loop: run_in_executor(readline) + print(flush=True)"""
+    loop = asyncio.get_event_loop()
+    text_in = open(stdin.fileno(), "r", closefd=False)
+    for _ in range(count):
+        line = await loop.run_in_executor(None, text_in.readline)
+        request = json.loads(line)
+        print(json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": {}}), file=stdout, flush=True)
+
+
+async def _stream_loop(stdin, stdout, count: int) -> None:
+    transport = server.StdioTransport(stdin=stdin, stdout=stdout)
+    await transport.connect()
+    sends = []
+    for _ in range(count):
+        request = json.loads(await transport.read_frame())
+        sends.append(asyncio.ensure_future(transport.send({"jsonrpc": "2.0", "id": request["id"], "result": {}})))
+    await asyncio.gather(*sends)
+    await transport.close()
+
+
+def _transport_run(loop_fn, count: int, payload: str, closed: bool, latencies) -> float:
+    stdin_r, stdin_w, stdout_r, stdout_w = _pipes()
+    if closed:
+        client = threading.Thread(target=_ping_pong, args=(stdin_w, stdout_r, count, payload, latencies))
+        threads = [client]
+    else:
+        threads = [threading.Thread(target=_feed_frames, args=(stdin_w, count, payload)),
+                   threading.Thread(target=_drain, args=(stdout_r,))]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    asyncio.run(loop_fn(stdin_r, stdout_w, count))
+    elapsed = time.perf_counter() - started
+    stdout_w.close()
+    for thread in threads:
+        thread.join()
+    stdin_r.close()
+    stdout_r.close()
+    return elapsed
+
+
+def bench_transport(args) -> None:
+    payload = "x" * args.payload_bytes
+    print(f"transport: {args.messages} frames, {args.payload_bytes} byte payload "
+          f"(throughput: all sent at once; latency: one ping in flight)")
+    for name, loop_fn in (("legacy", _legacy_loop), ("stream", _stream_loop)):
+        elapsed = _transport_run(loop_fn, args.messages, payload, False, [])
+        latencies = []
+        _transport_run(loop_fn, args.messages, payload, True, latencies)
+        print(f"{name:<12} {args.messages / elapsed:>12.0f} msg/s   "
+              f"rtt p50 {percentile(latencies, 50) * 1e6:>8.1f} µs   "
+              f"p99 {percentile(latencies, 99) * 1e6:>8.1f} µs")
+
+
+# ---------------------------------------------------------------------------
+# rpc: small-message requests/s through handle_stdin_input (codec, batching, pre-encoding)
+# ---------------------------------------------------------------------------
+
+def _feed_requests(wfile, count: int, batch: int) -> None:
+    """Writer thread: alternating ping / tools/list, `batch` requests per frame"""
+    methods = ("ping", "tools/list")
+    frame = []
+    for i in range(count):
+        frame.append({"jsonrpc": "2.0", "id": i, "method": methods[i % 2], "params": {}})
+        if len(frame) == batch or i == count - 1:
+            wfile.write(json.dumps(frame if batch > 1 else frame[0]).encode("utf-8") + b"\n")
+            frame = []
+    wfile.flush()
+    wfile.close()
+
+
+def _count_responses(rfile, counts) -> None:
+    """Reader thread: total response bytes"""
+    while True:
+        data = rfile.read(65536)
+        if not data:
+            return
+        counts["bytes"] += len(data)
+
+
+def _rpc_run(count: int, batch: int) -> tuple:
+    stdin_r, stdin_w, stdout_r, stdout_w = _pipes()
+    counts = {"bytes": 0}
+    feeder = threading.Thread(target=_feed_requests, args=(stdin_w, count, batch))
+    reader = threading.Thread(target=_count_responses, args=(stdout_r, counts))
+    fake = FakeDiscord(channel_id=4242, user_id=7, latency=0.0)
+
+    async def serve():
+        transport = server.StdioTransport(stdin=stdin_r, stdout=stdout_w)
+        await server.handle_stdin_input(server.MCPHandler(server.HumanInDiscord(fake, 4242, 7)), transport=transport)
+
+    reader.start()
+    started = time.perf_counter()
+    feeder.start()
+    asyncio.run(serve())
+    elapsed = time.perf_counter() - started
+    feeder.join()
+    reader.join()
+    stdin_r.close()
+    return elapsed, counts["bytes"]
+
+
+def bench_rpc(args) -> None:
+    logging.getLogger().setLevel(logging.WARNING)
+    fast_codec = server.orjson
+    preencoded = dict(server._PREENCODED_RESULTS)
+    variants = [("json", None, {})]
+    variants.append(("json+static", None, preencoded))
+    if fast_codec is not None:
+        variants.append(("orjson+static", fast_codec, preencoded))
+    print(f"rpc: {args.requests} requests (ping / tools/list), batch size {args.batch}"
+          + ("" if fast_codec else "  [orjson not installed]"))
+    for batch in sorted({1, args.batch}):
+        for name, codec, static in variants:
+            server.orjson = codec
+            server._PREENCODED_RESULTS = static
+            elapsed, nbytes = _rpc_run(args.requests, batch)
+            print(f"{name:<14} batch {batch:>3}  {args.requests / elapsed:>10.0f} req/s   "
+                  f"{nbytes / elapsed / 1e6:>7.1f} MB/s out")
+    server.orjson = fast_codec
+    server._PREENCODED_RESULTS = preencoded
+
+
+# ---------------------------------------------------------------------------
+# egress: chunking and attachment encoding for large payloads
+# ---------------------------------------------------------------------------
+
+def _log_dump(megabytes: float) -> str:
+    """A log-like payload with timestamps, tracebacks and fenced code blocks"""
+    lines = []
+    size = 0
+    i = 0
+    target = int(megabytes * 1024 * 1024)
+    while size < target:
+        if i % 200 == 0:
+            line = "```python" if (i // 200) % 2 == 0 else "```"
+        elif i % 97 == 0:
+            line = "Traceback (most recent call last): " + "frame " * 60
+        else:
+            line = f"2025-01-01T00:00:{i % 60:02d}Z INFO worker-{i % 8} processed item {i} in {i % 1000} ms"
+        lines.append(line)
+        size += len(line) + 1
+        i += 1
+    return "\n".join(lines)
+
+
+def bench_egress(args) -> None:
+    text = _log_dump(args.megabytes)
+    print(f"egress: {len(text) / 1024 / 1024:.1f} MB log dump")
+
+    started = time.perf_counter()
+    chunks = server.split_message(text)
+    elapsed = time.perf_counter() - started
+    assert all(len(chunk) <= server.DISCORD_MESSAGE_LIMIT for chunk in chunks)
+    print(f"{'split':<12} {len(chunks):>8} chunks   {len(text) / elapsed / 1e6:>8.1f} Mchar/s   {elapsed * 1e3:>8.1f} ms")
+
+    for name, gzip_bytes in (("attach", 0), ("attach+gzip", 1)):
+        started = time.perf_counter()
+        data, filename = server.encode_attachment(text, gzip_bytes)
+        elapsed = time.perf_counter() - started
+        print(f"{name:<12} {len(data) / 1024:>8.0f} KiB   {len(text) / elapsed / 1e6:>8.1f} Mchar/s   "
+              f"{elapsed * 1e3:>8.1f} ms   ({filename})")
+
+
+# ---------------------------------------------------------------------------
+# Fake Discord: the client surface HumanInTheLoopBot / HumanInDiscord use
+# ---------------------------------------------------------------------------
+
+class FakeResponse:
+    """Just enough of aiohttp's response for discord.HTTPException"""
+
+    def __init__(self, status: int, retry_after: float):
+        self.status = status
+        self.reason = "Too Many Requests"
+        self.headers = {"X-RateLimit-Limit": "5", "X-RateLimit-Remaining": "0",
+                        "X-RateLimit-Reset-After": str(retry_after), "Retry-After": str(retry_after)}
+
+
+class FakeUser:
+    def __init__(self, user_id: int, bot: bool = False):
+        self.id = user_id
+        self.bot = bot
+
+
+class FakeReference:
+    def __init__(self, message_id: int):
+        self.message_id = message_id
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, channel, author, content: str, reference=None):
+        self.id = message_id
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.reference = reference
+
+
+class FakeDiscord:
+    """In-process stand-in for the Discord client
+    
+    Every API call sleeps `latency` seconds and fails with a simulated 429
+    with probability `rate_limit_prob`. A simulated human answers each
+    message containing "?" after `think_time` seconds, replying to it
+    (half the time) or posting a plain message, by injecting on_message.
+    While `gateway_up` is False messages only land in thread history.
+    """
+
+    def __init__(self, channel_id: int, user_id: int, latency: float = 0.05, think_time: float = 0.1,
+                 rate_limit_prob: float = 0.0, retry_after: float = 0.05):
+        self.user = FakeUser(1, bot=True)
+        self.human = FakeUser(user_id)
+        self.target_channel_id = channel_id
+        self.target_user_id = user_id
+        self.latency = latency
+        self.think_time = think_time
+        self.rate_limit_prob = rate_limit_prob
+        self.retry_after = retry_after
+        self.ids = itertools.count(10 ** 17)
+        self.channels = {channel_id: FakeForumChannel(self, channel_id)}
+        self.calls = {"send": 0, "create_thread": 0, "edit": 0, "history": 0, "rate_limited": 0}
+        self.gateway_up = True
+
+    # discord.Client surface
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+    async def fetch_channel(self, channel_id: int):
+        await self.api_call("fetch_channel")
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            raise discord.NotFound(FakeResponse(404, 0), "Unknown Channel")
+        return channel
+
+    def get_user(self, user_id: int):
+        return self.human if user_id == self.human.id else None
+
+    async def fetch_user(self, user_id: int):
+        await self.api_call("fetch_user")
+        return self.get_user(user_id)
+
+    async def api_call(self, kind: str) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if kind in self.calls:
+            self.calls[kind] += 1
+        if self.rate_limit_prob and random.random() < self.rate_limit_prob:
+            self.calls["rate_limited"] += 1
+            raise discord.HTTPException(FakeResponse(429, self.retry_after), "You are being rate limited.")
+
+    def posted(self, message: FakeMessage) -> None:
+        """Let the simulated human answer questions"""
+        message.channel.messages.append(message)
+        if "?" not in (message.content or ""):
+            return
+        reference = FakeReference(message.id) if random.random() < 0.5 else None
+        answer = FakeMessage(next(self.ids), message.channel, self.human, f"answer to {message.id}", reference)
+        loop = asyncio.get_event_loop()
+        loop.call_later(self.think_time, lambda: asyncio.ensure_future(self.deliver(answer)))
+
+    async def deliver(self, message: FakeMessage) -> None:
+        """A human message: stored in the thread, dispatched only while the gateway is up"""
+        message.channel.messages.append(message)
+        if self.gateway_up:
+            await self.on_message(message)
+
+    async def on_message(self, message) -> None:
+        await server.HumanInTheLoopBot.on_message(self, message)
+
+
+class FakeThread(discord.Thread):
+    def __init__(self, client: FakeDiscord, thread_id: int, parent_id: int, name: str):
+        self.client = client
+        self.id = thread_id
+        self.parent_id = parent_id
+        self.name = name
+        self.archived = False
+        self.messages = []  # ascending ids, like the channel history
+
+    async def history(self, limit: int = 100, after=None, oldest_first: bool = True):
+        await self.client.api_call("history")  # one REST page per call
+        start = 0
+        if after is not None:
+            start = next((i for i, m in enumerate(self.messages) if m.id > after.id), len(self.messages))
+        for message in self.messages[start:start + limit]:
+            yield message
+
+    async def send(self, content=None, **kwargs):
+        await self.client.api_call("send")
+        message = FakeMessage(next(self.client.ids), self, self.client.user, content)
+        self.client.posted(message)
+        return message
+
+    async def edit(self, **kwargs):
+        await self.client.api_call("edit")
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        return self
+
+
+class FakeThreadWithMessage:
+    def __init__(self, thread, message):
+        self.thread = thread
+        self.message = message
+
+
+class FakeForumChannel(discord.ForumChannel):
+    def __init__(self, client: FakeDiscord, channel_id: int):
+        self.client = client
+        self.id = channel_id
+
+    async def create_thread(self, name: str, content: str = None, **kwargs):
+        await self.client.api_call("create_thread")
+        thread = FakeThread(self.client, next(self.client.ids), self.id, name)
+        self.client.channels[thread.id] = thread
+        starter = FakeMessage(thread.id, thread, self.client.user, content)  # forum starter id == thread id
+        self.client.posted(starter)
+        return FakeThreadWithMessage(thread, starter)
+
+
+# ---------------------------------------------------------------------------
+# load: scripted JSON-RPC clients driving handle_stdin_input over pipes
+# ---------------------------------------------------------------------------
+
+def _peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # KiB on Linux
+
+
+def _transport_pair():
+    """(server transport, client transport) joined by two OS pipes"""
+    c2s_r, c2s_w = os.pipe()
+    s2c_r, s2c_w = os.pipe()
+    server_side = server.StdioTransport(stdin=os.fdopen(c2s_r, "rb", buffering=0),
+                                        stdout=os.fdopen(s2c_w, "wb", buffering=0))
+    client_side = server.StdioTransport(stdin=os.fdopen(s2c_r, "rb", buffering=0),
+                                        stdout=os.fdopen(c2s_w, "wb", buffering=0))
+    return server_side, client_side
+
+
+async def _scripted_client(transport, calls: int, depth: int, ask_ratio: float, latencies) -> None:
+    """initialize + tools/list, then `calls` tool calls with up to `depth` in flight"""
+    await transport.connect()
+    waiting = {}
+    ids = itertools.count(1)
+
+    async def read_responses():
+        while waiting:
+            frame = await transport.read_frame()
+            if frame is None:
+                break
+            response = json.loads(frame)
+            entry = waiting.pop(response.get("id"), None)
+            if entry:
+                started, kind, future = entry
+                latencies.setdefault(kind, []).append(time.perf_counter() - started)
+                future.set_result(response)
+
+    slots = asyncio.Semaphore(depth)
+    reader = None
+    script = [("initialize", {"protocolVersion": "2024-11-05", "capabilities": {}}), ("tools/list", {})]
+    for _ in range(calls):
+        if random.random() < ask_ratio:
+            script.append(("ask_human", {"question": f"Proceed with step {random.randint(1, 9999)}?"}))
+        else:
+            script.append(("report_to_human", {"message": f"progress {random.randint(1, 9999)}"}))
+
+    futures = []
+    for kind, arguments in script:
+        await slots.acquire()
+        request_id = next(ids)
+        if kind in ("initialize", "tools/list"):
+            request = {"jsonrpc": "2.0", "id": request_id, "method": kind, "params": arguments}
+        else:
+            request = {"jsonrpc": "2.0", "id": request_id, "method": "tools/call",
+                       "params": {"name": kind, "arguments": arguments}}
+        future = asyncio.get_event_loop().create_future()
+        future.add_done_callback(lambda _: slots.release())
+        waiting[request_id] = (time.perf_counter(), kind, future)
+        futures.append(future)
+        await transport.send(request)
+        if reader is None:
+            reader = asyncio.ensure_future(read_responses())
+    await asyncio.gather(*futures)
+    await transport.close()  # EOF for the server loop
+    await reader
+
+
+async def _run_load(args, latencies) -> dict:
+    fake = FakeDiscord(channel_id=4242, user_id=7, latency=args.latency_ms / 1000.0,
+                       think_time=args.think_ms / 1000.0, rate_limit_prob=args.rate_limit_prob)
+    server.discord_ready.set()  # no gateway handshake to wait for
+    if not args.real_rate_limits:
+        server.discord_scheduler.route_limits.update({kind: (10 ** 6, 1.0) for kind in server.DEFAULT_ROUTE_LIMITS})
+
+    sessions = []
+    for _ in range(args.sessions):
+        human = server.HumanInDiscord(fake, fake.target_channel_id, fake.target_user_id,
+                                      report_flush_seconds=args.flush_ms / 1000.0)
+        server_side, client_side = _transport_pair()
+        serve = server.handle_stdin_input(server.MCPHandler(human), args.max_concurrent_tool_calls, server_side)
+        client = _scripted_client(client_side, args.calls, args.depth, args.ask_ratio, latencies)
+        sessions.append(asyncio.gather(serve, client))
+
+    started = time.perf_counter()
+    await asyncio.gather(*sessions)
+    return {"elapsed": time.perf_counter() - started, "discord": fake.calls}
+
+
+def bench_load(args) -> None:
+    logging.getLogger().setLevel(getattr(logging, args.log_level))
+    os.environ.pop("GOOGLE_AI_API_KEY", None)  # titles use the offline fallback
+    random.seed(args.seed)
+    latencies = {}
+    result = asyncio.run(_run_load(args, latencies))
+
+    total = sum(len(samples) for samples in latencies.values())
+    print(f"load: {args.sessions} sessions x {args.calls} calls, depth {args.depth}, "
+          f"discord latency {args.latency_ms} ms, human think {args.think_ms} ms, 429 prob {args.rate_limit_prob}")
+    print(f"{'kind':<16} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for kind in sorted(latencies):
+        samples = latencies[kind]
+        print(f"{kind:<16} {len(samples):>7} {percentile(samples, 50) * 1e3:>9.1f} "
+              f"{percentile(samples, 95) * 1e3:>9.1f} {percentile(samples, 99) * 1e3:>9.1f}")
+    print(f"throughput       {total / result['elapsed']:.0f} req/s over {result['elapsed']:.2f} s")
+    print(f"discord calls    {result['discord']}")
+    print(f"peak RSS         {_peak_rss_mb():.1f} MB")
+
+
+# ---------------------------------------------------------------------------
+# startup: time-to-first-response of a cold process
+# ---------------------------------------------------------------------------
+
+def startup_child(args) -> None:
+    """Server process for `startup`: real imports and stdio loop, gateway simulated by a delay"""
+    logging.getLogger().setLevel(logging.WARNING)
+    fake = FakeDiscord(channel_id=4242, user_id=7, latency=0.0, think_time=0.0)
+
+    async def serve():
+        asyncio.get_event_loop().call_later(args.ready_delay_ms / 1000.0, server.discord_ready.set)
+        await server.handle_stdin_input(server.MCPHandler(server.HumanInDiscord(fake, 4242, 7)))
+
+    asyncio.run(serve())
+    sys.stderr.write(json.dumps({"genai_imported": "google.generativeai" in sys.modules}) + "\n")
+
+
+def bench_startup(args) -> None:
+    requests = [
+        {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {"protocolVersion": "2024-11-05", "capabilities": {}}},
+        {"jsonrpc": "2.0", "id": 2, "method": "tools/list", "params": {}},
+        {"jsonrpc": "2.0", "id": 3, "method": "tools/call", "params": {"name": "ask_human", "arguments": {"question": "Ready?"}}},
+    ]
+    names = {1: "initialize", 2: "tools/list", 3: "ask_human"}
+    env = dict(os.environ)
+    env.pop("GOOGLE_AI_API_KEY", None)
+    results = {name: [] for name in names.values()}
+    genai_imported = False
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "startup-child",
+                                  "--ready-delay-ms", str(args.ready_delay_ms)],
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        child.stdin.write(b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in requests))
+        child.stdin.flush()
+        for _ in requests:
+            response = json.loads(child.stdout.readline())
+            results[names[response["id"]]].append(time.perf_counter() - started)
+        _, stderr = child.communicate(timeout=30)  # closes stdin: EOF ends the server
+        for line in stderr.decode("utf-8", "replace").splitlines():
+            if line.startswith("{"):
+                genai_imported = genai_imported or json.loads(line)["genai_imported"]
+
+    print(f"startup: {args.runs} cold starts, simulated gateway handshake {args.ready_delay_ms} ms")
+    print(f"{'response':<12} {'p50 ms':>9} {'max ms':>9}")
+    for name, samples in results.items():
+        print(f"{name:<12} {percentile(samples, 50) * 1e3:>9.1f} {max(samples) * 1e3:>9.1f}")
+    print(f"Gemini SDK imported: {genai_imported}")
+
+
+# ---------------------------------------------------------------------------
+# gateway: memory and event-processing cost of the default vs --lean bot
+# ---------------------------------------------------------------------------
+
+def _rss_mb() -> float:
+    """Current resident set size (Linux); falls back to peak RSS elsewhere"""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return _peak_rss_mb()
+
+
+def _synthetic_guild(guild_id: int, channels: int, threads: int, voice_members: int) -> dict:
+    stamp = "2025-01-01T00:00:00+00:00"
+    ids = itertools.count(guild_id + 1)
+    channel_list = [{"id": str(guild_id), "type": 15, "name": "ai-questions", "position": 0, "permission_overwrites": []}]
+    channel_list += [{"id": str(next(ids)), "type": 0, "name": f"text-{i}", "position": i + 1,
+                      "permission_overwrites": []} for i in range(channels)]
+    thread_list = [{"id": str(next(ids)), "type": 11, "parent_id": channel_list[1 + i % channels]["id"],
+                    "guild_id": str(guild_id), "name": f"thread-{i}", "owner_id": "1", "message_count": 0,
+                    "member_count": 0, "rate_limit_per_user": 0,
+                    "thread_metadata": {"archived": False, "auto_archive_duration": 1440,
+                                        "archive_timestamp": stamp, "locked": False}} for i in range(threads)]
+    voice_users = [str(next(ids)) for _ in range(voice_members)]
+    return {
+        "id": str(guild_id), "name": "bench", "owner_id": "1", "member_count": 50000, "large": True,
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0,
+                   "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+        "emojis": [], "stickers": [], "features": [], "channels": channel_list, "threads": thread_list,
+        "members": [_synthetic_member(user_id, stamp) for user_id in voice_users],
+        "voice_states": [{"user_id": user_id, "channel_id": channel_list[1]["id"], "session_id": "x",
+                          "deaf": False, "mute": False, "self_deaf": False, "self_mute": False,
+                          "self_video": False, "suppress": False} for user_id in voice_users],
+    }
+
+
+def _synthetic_member(user_id: str, stamp: str) -> dict:
+    return {"user": {"id": user_id, "username": f"user{user_id}", "discriminator": "0", "avatar": None,
+                     "global_name": None}, "roles": [], "joined_at": stamp, "deaf": False, "mute": False, "flags": 0}
+
+
+def gateway_child(args) -> None:
+    """Replay synthetic gateway traffic into one bot's connection state and report its footprint"""
+    logging.getLogger().setLevel(logging.ERROR)
+    guild_id = 10 ** 17
+    before = _rss_mb()
+    started = time.perf_counter()
+
+    async def replay():
+        bot = server.HumanInTheLoopBot(lean=args.lean)
+        await bot._async_setup_hook()  # binds the loop, as login() would
+        state = bot._connection
+        state.user = discord.ClientUser(state=state, data={"id": "1", "username": "bot", "discriminator": "0",
+                                                            "avatar": None, "global_name": None, "bot": True})
+        intents = state._intents
+        # Discord only sends what the intents subscribe to
+        state.parse_guild_create(_synthetic_guild(guild_id, args.channels, args.threads,
+                                                  args.voice_members if intents.voice_states else 0))
+        guild_ready = time.perf_counter() - started
+        guild = bot.get_guild(guild_id)
+        targets = [c.id for c in guild.text_channels] + [t.id for t in guild.threads]
+        stamp = "2025-01-01T00:00:00+00:00"
+        rng = random.Random(1)
+        for i in range(args.messages):
+            author = str(2 * 10 ** 17 + rng.randrange(args.authors))
+            channel_id = str(targets[rng.randrange(len(targets))])
+            member = _synthetic_member(author, stamp)
+            if intents.guild_typing:
+                state.parse_typing_start({"channel_id": channel_id, "guild_id": str(guild_id), "user_id": author,
+                                          "timestamp": 1700000000, "member": member})
+            state.parse_message_create({
+                "id": str(3 * 10 ** 17 + i), "channel_id": channel_id, "guild_id": str(guild_id),
+                "author": member["user"], "member": {k: v for k, v in member.items() if k != "user"},
+                "content": "x" * 200 if intents.message_content else "", "timestamp": stamp,
+                "edited_timestamp": None, "tts": False, "mention_everyone": False, "mentions": [],
+                "mention_roles": [], "attachments": [], "embeds": [], "pinned": False, "type": 0})
+            if i % 1000 == 0:
+                await asyncio.sleep(0)  # let dispatched on_message tasks run
+        await asyncio.sleep(0)
+        return guild_ready, len(bot.cached_messages), len(guild.members)
+
+    guild_ready, cached_messages, cached_members = asyncio.run(replay())
+    print(json.dumps({"guild_create_ms": guild_ready * 1e3, "replay_s": time.perf_counter() - started,
+                      "rss_delta_mb": _rss_mb() - before, "cached_messages": cached_messages,
+                      "cached_members": cached_members}))
+
+
+def bench_gateway(args) -> None:
+    print(f"gateway: {args.channels} channels, {args.threads} active threads, {args.messages} messages "
+          f"from {args.authors} authors, {args.voice_members} members in voice")
+    print(f"{'profile':<8} {'guild ms':>9} {'replay s':>9} {'RSS +MB':>8} {'messages':>9} {'members':>8}")
+    for lean in (False, True):
+        command = [sys.executable, os.path.abspath(__file__), "gateway-child"]
+        for flag in ("channels", "threads", "messages", "authors", "voice_members"):
+            command += [f"--{flag.replace('_', '-')}", str(getattr(args, flag))]
+        if lean:
+            command.append("--lean")
+        result = json.loads(subprocess.check_output(command).decode("utf-8").strip().splitlines()[-1])
+        print(f"{'lean' if lean else 'default':<8} {result['guild_create_ms']:>9.1f} {result['replay_s']:>9.2f} "
+              f"{result['rss_delta_mb']:>8.1f} {result['cached_messages']:>9} {result['cached_members']:>8}")
+
+
+# ---------------------------------------------------------------------------
+# recovery: replaying answers missed while the gateway was down
+# ---------------------------------------------------------------------------
+
+async def _run_recovery(args) -> dict:
+    fake = FakeDiscord(channel_id=4242, user_id=7, latency=args.latency_ms / 1000.0, think_time=0.0)
+    server.discord_ready.set()
+    human = server.HumanInDiscord(fake, fake.target_channel_id, fake.target_user_id)
+    thread, _ = await human.get_or_create_thread("recovery")
+
+    # A long thread the bot already saw live
+    for i in range(args.history):
+        fake.posted(FakeMessage(next(fake.ids), thread, fake.user, f"old {i}"))
+        if i == args.history - 1:
+            await fake.on_message(thread.messages[-1])
+
+    # Outage: questions are answered, plus unrelated chatter, but no events arrive
+    fake.gateway_up = False
+    tickets = [await human.ask_async(f"question {i}?") for i in range(args.questions)]
+    await asyncio.sleep(0.01)  # let the simulated human answer
+    for i in range(max(0, args.gap - 2 * args.questions)):
+        fake.posted(FakeMessage(next(fake.ids), thread, fake.user, f"chatter {i}"))
+    fake.gateway_up = True
+
+    before = fake.calls["history"]
+    started = time.perf_counter()
+    recovered = await server.recover_missed_answers(fake, "bench")
+    elapsed = time.perf_counter() - started
+    answered = sum(human.check_ticket(t)["status"] == "answered" for t in tickets)
+    await human.close()
+    return {"elapsed": elapsed, "pages": fake.calls["history"] - before, "recovered": recovered,
+            "answered": answered, "thread_messages": len(thread.messages)}
+
+
+def bench_recovery(args) -> None:
+    logging.getLogger().setLevel(logging.WARNING)
+    os.environ.pop("GOOGLE_AI_API_KEY", None)
+    result = asyncio.run(_run_recovery(args))
+    full_pages = -(-result["thread_messages"] // server.RECOVERY_PAGE_SIZE)
+    print(f"recovery: thread of {result['thread_messages']} messages, {args.gap} missed, "
+          f"{args.questions} questions, history latency {args.latency_ms} ms")
+    print(f"history pages    {result['pages']} (full rescan would be {full_pages})")
+    print(f"answers replayed {result['recovered']} ({result['answered']}/{args.questions} tickets answered)")
+    print(f"recovery time    {result['elapsed'] * 1e3:.1f} ms")
+
+
+# ---------------------------------------------------------------------------
+# deadlines: many waiting questions, per-question wait_for vs the shared heap
+# ---------------------------------------------------------------------------
+
+async def _run_deadlines(count: int, shared: bool) -> dict:
+    loop = asyncio.get_event_loop()
+    futures = [loop.create_future() for _ in range(count)]
+    started = time.perf_counter()
+    if shared:
+        async def remind(level):
+            pass
+        for future in futures:
+            server.question_deadlines.add(future, server.ASK_TIMEOUT_SECONDS, remind=remind)
+        waiters = [asyncio.ensure_future(future) for future in futures]
+    else:
+        waiters = [asyncio.ensure_future(asyncio.wait_for(future, server.ASK_TIMEOUT_SECONDS)) for future in futures]
+    await asyncio.sleep(0)  # let every waiter start (and arm its timer)
+    registered = time.perf_counter() - started
+    timers = len(getattr(loop, "_scheduled", ()))
+    
+    started = time.perf_counter()
+    for i, future in enumerate(futures):
+        future.set_result(i)
+    await asyncio.gather(*waiters)
+    resolved = time.perf_counter() - started
+    return {"registered": registered, "resolved": resolved, "timers": timers}
+
+
+def bench_deadlines(args) -> None:
+    print(f"{args.questions} questions waiting {server.ASK_TIMEOUT_SECONDS} s, "
+          f"reminders at {', '.join(f'{r:g}' for r in server.question_deadlines.reminders)} s")
+    print(f"{'':<14} {'register':>10} {'answer all':>11} {'loop timers':>12}")
+    for name, shared in (("wait_for", False), ("shared heap", True)):
+        result = asyncio.run(_run_deadlines(args.questions, shared))
+        print(f"{name:<14} {result['registered'] * 1e3:>8.1f}ms {result['resolved'] * 1e3:>9.1f}ms "
+              f"{result['timers']:>12}")
+
+
+# ---------------------------------------------------------------------------
+# logging: time the event loop spends per log call, direct vs queued
+# ---------------------------------------------------------------------------
+
+def _slow_sink(read_fd: int, pause: float) -> None:
+    """A stderr reader that keeps up only slowly (a busy terminal or a full pipe)"""
+    with os.fdopen(read_fd, "rb", buffering=0) as rfile:
+        while rfile.read(4096):
+            time.sleep(pause)
+
+
+async def _emit_records(count: int, latencies) -> None:
+    log = logging.getLogger("bench")
+    server.log_request_id.set(42)
+    for i in range(count):
+        started = time.perf_counter()
+        log.info("🔧 ask_human called with: %.50s...", f"question number {i} " * 4)
+        latencies.append(time.perf_counter() - started)
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+
+
+def bench_logging(args) -> None:
+    print(f"logging: {args.records} records into a sink draining 4 KiB per {args.sink_pause_ms} ms")
+    for name in ("direct", "queued"):
+        read_fd, write_fd = os.pipe()
+        drain = threading.Thread(target=_slow_sink, args=(read_fd, args.sink_pause_ms / 1000.0), daemon=True)
+        drain.start()
+        sink = os.fdopen(write_fd, "w", encoding="utf-8")
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        if name == "direct":
+            server.stop_logging()
+            handler = logging.StreamHandler(sink)
+            handler.setFormatter(server.TraceFormatter(server.LOG_FORMAT))
+            root.addHandler(handler)
+            root.setLevel(logging.INFO)
+        else:
+            saved, sys.stderr = sys.stderr, sink
+            server.configure_logging(logging.INFO)
+            sys.stderr = saved
+
+        latencies = []
+        started = time.perf_counter()
+        asyncio.run(_emit_records(args.records, latencies))
+        elapsed = time.perf_counter() - started
+        server.stop_logging()  # queued: wait for the listener to write everything out
+        flushed = time.perf_counter() - started
+        sink.close()
+        drain.join()
+        print(f"{name:<8} loop {elapsed * 1e3:>8.1f} ms   written after {flushed * 1e3:>8.1f} ms   "
+              f"p50 {percentile(latencies, 50) * 1e6:>7.1f} µs   p99 {percentile(latencies, 99) * 1e6:>7.1f} µs   "
+              f"max {max(latencies) * 1e3:>7.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the human-in-the-loop MCP server")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    p = sub.add_parser("transport", help="stdin/stdout framing throughput and latency")
+    p.add_argument("--messages", type=int, default=20000)
+    p.add_argument("--payload-bytes", type=int, default=256)
+    p.set_defaults(func=bench_transport)
+
+    p = sub.add_parser("rpc", help="small-message requests/s: codec, batching, pre-encoded static results")
+    p.add_argument("--requests", type=int, default=50000)
+    p.add_argument("--batch", type=int, default=10, help="requests per JSON-RPC batch frame")
+    p.set_defaults(func=bench_rpc)
+
+    p = sub.add_parser("egress", help="chunking / attachment encoding of multi-megabyte payloads")
+    p.add_argument("--megabytes", type=float, default=8)
+    p.set_defaults(func=bench_egress)
+
+    p = sub.add_parser("load", help="N concurrent MCP sessions against a fake Discord")
+    p.add_argument("--sessions", type=int, default=10)
+    p.add_argument("--calls", type=int, default=50, help="tool calls per session")
+    p.add_argument("--depth", type=int, default=8, help="requests in flight per session")
+    p.add_argument("--ask-ratio", type=float, default=0.3, help="fraction of calls that are ask_human")
+    p.add_argument("--latency-ms", type=float, default=50.0, help="fake Discord API latency")
+    p.add_argument("--think-ms", type=float, default=100.0, help="simulated human answer delay")
+    p.add_argument("--rate-limit-prob", type=float, default=0.02, help="probability of a simulated 429")
+    p.add_argument("--flush-ms", type=float, default=server.REPORT_FLUSH_SECONDS * 1000, help="report flush window")
+    p.add_argument("--max-concurrent-tool-calls", type=int, default=server.DEFAULT_MAX_CONCURRENT_TOOL_CALLS)
+    p.add_argument("--real-rate-limits", action="store_true", help="keep Discord's per-route limits in the scheduler")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--log-level", default="WARNING", choices=("DEBUG", "INFO", "WARNING", "ERROR"))
+    p.set_defaults(func=bench_load)
+
+    p = sub.add_parser("recovery", help="history read back after a gateway outage: gap vs thread length")
+    p.add_argument("--history", type=int, default=20000, help="messages already in the thread")
+    p.add_argument("--gap", type=int, default=50, help="messages posted while disconnected")
+    p.add_argument("--questions", type=int, default=5, help="questions answered during the outage")
+    p.add_argument("--latency-ms", type=float, default=50.0, help="fake Discord API latency per page")
+    p.set_defaults(func=bench_recovery)
+
+    p = sub.add_parser("logging", help="event-loop time per log call: direct stderr handler vs the queue pipeline")
+    p.add_argument("--records", type=int, default=20000)
+    p.add_argument("--sink-pause-ms", type=float, default=0.2, help="reader pause per 4 KiB drained")
+    p.set_defaults(func=bench_logging)
+
+    p = sub.add_parser("deadlines", help="timer cost of many waiting questions: wait_for vs the deadline heap")
+    p.add_argument("--questions", type=int, default=10000)
+    p.set_defaults(func=bench_deadlines)
+
+    p = sub.add_parser("startup", help="time from process start to the first MCP responses")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--ready-delay-ms", type=float, default=1500.0, help="simulated Discord gateway handshake")
+    p.set_defaults(func=bench_startup)
+
+    for name, func in (("gateway", bench_gateway), ("gateway-child", gateway_child)):
+        p = sub.add_parser(name, help="memory / CPU of synthetic gateway traffic, default vs --lean bot"
+                           if name == "gateway" else None)
+        p.add_argument("--channels", type=int, default=200)
+        p.add_argument("--threads", type=int, default=500)
+        p.add_argument("--messages", type=int, default=20000)
+        p.add_argument("--authors", type=int, default=5000)
+        p.add_argument("--voice-members", type=int, default=2000)
+        p.add_argument("--lean", action="store_true")
+        p.set_defaults(func=func)
+
+    p = sub.add_parser("startup-child")  # server side of `startup`
+    p.add_argument("--ready-delay-ms", type=float, default=1500.0)
+    p.set_defaults(func=startup_child)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
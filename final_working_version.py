@@ -9,37 +9,1617 @@ import os
 import sys
 import logging
 import argparse
+import atexit
+import sqlite3
+import time
+import hashlib
+import heapq
+import itertools
+import functools
+import gzip
+import io
+import re
+import contextlib
+import contextvars
+import bisect
+import queue
+import logging.handlers
+from collections import Counter, OrderedDict, deque
 from typing import Optional, Dict, Any
 
+# Time-to-first-response is measured from here: before discord.py, the import that dominates startup
+PROCESS_STARTED = time.perf_counter()
+
 import discord
 from discord.ext import commands
 
-# Google AI SDK for title generation
+# Optional fast JSON codec for the MCP wire format
 try:
-    import google.generativeai as genai
+    import orjson
 except ImportError:
-    genai = None
-    logging.warning("Google AI SDK not available - title generation will use fallback method")
+    orjson = None
+
+# Google AI SDK for title generation; imported on first use (see load_genai)
+genai = None
+_genai_checked = False
+
+# Logging: call sites only enqueue records; a listener thread formats and writes them
+LOG_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+
+# Trace ids stamped on every record: the MCP request being handled and its Discord thread
+log_request_id: contextvars.ContextVar = contextvars.ContextVar("log_request_id", default=None)
+log_thread_id: contextvars.ContextVar = contextvars.ContextVar("log_thread_id", default=None)
+
+def spawn_untraced(coro) -> asyncio.Future:
+    """Start a long-lived background task outside the current request's trace ids
+    
+    Tasks copy the context they are created in, so a worker started during a
+    tool call would otherwise tag everything it ever logs with that call's id.
+    Work items carry their own ids and set them while they are handled.
+    """
+    return contextvars.Context().run(asyncio.ensure_future, coro)
+
+def current_trace() -> tuple:
+    """(request id, thread id) to carry on queued work"""
+    return log_request_id.get(), log_thread_id.get()
+
+def set_trace(trace: tuple) -> None:
+    log_request_id.set(trace[0])
+    log_thread_id.set(trace[1])
+
+class _TraceQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records unformatted, tagged with the caller's trace ids
+    
+    The stock QueueHandler formats in prepare(); skipping that leaves
+    %-style arguments to be merged by the listener thread, off the event loop.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = log_request_id.get()
+        record.thread_id = log_thread_id.get()
+        return record
+
+class TraceFormatter(logging.Formatter):
+    """Plain text, with "[request=… thread=…]" appended when the record has trace ids"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        thread_id = getattr(record, "thread_id", None)
+        if request_id is None and thread_id is None:
+            return text
+        return f"{text} [request={request_id} thread={thread_id}]"
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record, for the rotating log file"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "thread_id": getattr(record, "thread_id", None),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+def configure_logging(level=logging.INFO, log_file: Optional[str] = None,
+                      max_bytes: int = LOG_FILE_MAX_BYTES, backups: int = LOG_FILE_BACKUPS) -> None:
+    """(Re)install the queue pipeline on the root logger: text to stderr, optional JSON lines to `log_file`"""
+    global _log_listener
+    stop_logging()
+    stderr = logging.StreamHandler(sys.stderr)
+    stderr.setFormatter(TraceFormatter(LOG_FORMAT))
+    handlers = [stderr]
+    if log_file:
+        rotating = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backups,
+                                                        encoding="utf-8")
+        rotating.setFormatter(JsonLinesFormatter())
+        handlers.append(rotating)
+    
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_TraceQueueHandler(records))
+    root.setLevel(level)
+    _log_listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _log_listener.start()
+
+def stop_logging() -> None:
+    """Write out everything still queued (process exit, reconfiguration)"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
+configure_logging(os.getenv("LOG_LEVEL", "INFO").upper())
+atexit.register(stop_logging)
+
+# Histogram bucket upper bounds (seconds): sub-ms stdio up to the 6-hour human wait
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+                   60.0, 300.0, 900.0, 1800.0, 3600.0, 10800.0, 21600.0)
+METRICS_DUMP_INTERVAL_SECONDS = 15.0
+
+class Histogram:
+    """Cumulative-bucket latency histogram (Prometheus semantics)"""
+    
+    __slots__ = ("bounds", "counts", "sum", "count")
+    
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.bounds[-1]  # beyond the last bucket; keep the snapshot valid JSON
+
+class Metrics:
+    """Process-wide counters, gauges and latency histograms
+    
+    Exposed as Prometheus text (render_prometheus), as a JSON-friendly
+    snapshot for the MCP `stats` tool, and optionally over a local HTTP
+    endpoint or a periodically rewritten file.
+    """
+    
+    def __init__(self):
+        self.started = time.time()
+        self.counters: Dict[tuple, float] = {}
+        self.gauges: Dict[tuple, float] = {}
+        self.histograms: Dict[tuple, Histogram] = {}
+    
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> tuple:
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None)))
+    
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+    
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        self.gauges[self._key(name, labels)] = value
+    
+    def add_gauge(self, name: str, delta: float, **labels) -> None:
+        key = self._key(name, labels)
+        self.gauges[key] = self.gauges.get(key, 0) + delta
+    
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+    
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the wall-clock duration of a with-block (also inside coroutines)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+    
+    @staticmethod
+    def _format(name: str, labels: tuple, extra: Optional[tuple] = None) -> str:
+        pairs = labels + (extra or ())
+        if not pairs:
+            return name
+        escaped = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                           for k, v in pairs)
+        return f"{name}{{{escaped}}}"
+    
+    def render_prometheus(self) -> str:
+        lines = []
+        typed = set()
+        
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+        
+        for (name, labels), value in sorted(self.counters.items()):
+            declare(name, "counter")
+            lines.append(f"{self._format(name, labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            declare(name, "gauge")
+            lines.append(f"{self._format(name, labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self._format(name + '_bucket', labels, (('le', le),))} {cumulative}")
+            lines.append(f"{self._format(name + '_sum', labels)} {histogram.sum}")
+            lines.append(f"{self._format(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "uptime_seconds": round(time.time() - self.started, 3),
+            "counters": {self._format(name, labels): value for (name, labels), value in self.counters.items()},
+            "gauges": {self._format(name, labels): value for (name, labels), value in self.gauges.items()},
+            "histograms": {
+                self._format(name, labels): {
+                    "count": h.count,
+                    "sum": round(h.sum, 6),
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                    "p99": h.quantile(0.99),
+                }
+                for (name, labels), h in self.histograms.items()
+            },
+        }
+
+async def serve_metrics(port: int, host: str = "127.0.0.1"):
+    """Minimal local HTTP endpoint answering every GET with Prometheus text"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # skip headers
+            if request_line.split(b" ")[1:2] in ([b"/metrics"], [b"/"]):
+                body = metrics.render_prometheus().encode("utf-8")
+                status = b"200 OK"
+            else:
+                body = b"not found\n"
+                status = b"404 Not Found"
+            writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+            await writer.drain()
+        except Exception as e:
+            logging.debug("metrics request failed: %s", e)
+        finally:
+            writer.close()
+    
+    server = await asyncio.start_server(handle, host, port)
+    logging.info("📈 Metrics at http://%s:%s/metrics", host, port)
+    return server
+
+async def dump_metrics_periodically(path: str, interval: float = METRICS_DUMP_INTERVAL_SECONDS) -> None:
+    """Rewrite `path` with Prometheus text every `interval` seconds (atomic replace)"""
+    while True:
+        await asyncio.sleep(interval)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                fh.write(metrics.render_prometheus())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.error("❌ Failed to write metrics file: %s", e)
+
+class PendingQuestions:
+    """Index of unanswered ask_human questions
+    
+    Each question is registered per thread (oldest first) and under the IDs of
+    the Discord messages that carried it, so a reply to a question message
+    resolves exactly that question and a plain message resolves the oldest one.
+    Questions re-attached after a restart only take replies to their own
+    messages until an agent waits on them again.
+    """
+    
+    def __init__(self):
+        self.by_thread: Dict[int, Dict[asyncio.Future, list]] = {}  # thread id -> {future: message ids}, FIFO order
+        self.by_message: Dict[int, asyncio.Future] = {}  # question message id -> future
+        self.replies_only: set = set()  # futures skipped by the FIFO fallback
+    
+    def add(self, thread_id: int, future: asyncio.Future, replies_only: bool = False) -> None:
+        self.by_thread.setdefault(thread_id, {})[future] = []
+        if replies_only:
+            self.replies_only.add(future)
+    
+    def accept_plain(self, future: asyncio.Future) -> None:
+        """Let plain messages answer this question again (an agent is waiting on it)"""
+        self.replies_only.discard(future)
+    
+    def link_message(self, thread_id: int, future: asyncio.Future, message_id: int) -> None:
+        """Make replies to message_id resolve this question"""
+        waiting = self.by_thread.get(thread_id)
+        if waiting is None or future not in waiting:
+            return
+        waiting[future].append(message_id)
+        self.by_message[message_id] = future
+    
+    def discard(self, thread_id: int, future: asyncio.Future) -> None:
+        waiting = self.by_thread.get(thread_id)
+        if waiting is None or future not in waiting:
+            return
+        self.replies_only.discard(future)
+        for message_id in waiting.pop(future):
+            self.by_message.pop(message_id, None)
+        if not waiting:
+            del self.by_thread[thread_id]
+    
+    def waiting(self, thread_id: int) -> int:
+        return len(self.by_thread.get(thread_id, ()))
+    
+    def __contains__(self, thread_id: int) -> bool:
+        return thread_id in self.by_thread
+    
+    def resolve(self, thread_id: int, answer: str, reply_to: Optional[int] = None) -> bool:
+        """Hand an answer to the question it replies to, or to the oldest waiting one"""
+        waiting = self.by_thread.get(thread_id)
+        if not waiting:
+            return False
+        
+        future = self.by_message.get(reply_to) if reply_to is not None else None
+        if future is None or future not in waiting:
+            # FIFO fallback for plain messages
+            future = next((f for f in waiting if f not in self.replies_only), None)
+            if future is None:
+                return False
+        
+        self.discard(thread_id, future)
+        if future.done():
+            return False
+        future.set_result(answer)
+        return True
+
+# Message ids remembered across watched threads, so a message delivered live and
+# again by reconnect recovery is only handled once
+SEEN_MESSAGE_IDS = 4096
+
+class ThreadRoutes:
+    """thread id -> (session, authorized responder ids)
+    
+    The only lookup on_message does before any other work, so unrelated
+    traffic costs one dict miss however many channels and sessions exist.
+    Also tracks the last message seen in each watched thread: the point
+    reconnect recovery resumes reading history from.
+    """
+    
+    def __init__(self, seen_size: int = SEEN_MESSAGE_IDS):
+        self.routes: Dict[int, tuple] = {}
+        self.last_seen: Dict[int, int] = {}  # thread id -> newest message id seen
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._seen_size = seen_size
+    
+    def register(self, thread_id: int, session, responders: frozenset) -> None:
+        self.routes[thread_id] = (session, responders)
+    
+    def unregister(self, thread_id: int, session) -> None:
+        route = self.routes.get(thread_id)
+        if route is not None and route[0] is session:
+            del self.routes[thread_id]
+            self.last_seen.pop(thread_id, None)
+    
+    def seen(self, thread_id: int, message_id: int) -> bool:
+        """Record a message in a watched thread; False if it was handled already"""
+        if message_id in self._seen:
+            return False
+        self._seen[message_id] = None
+        if len(self._seen) > self._seen_size:
+            self._seen.popitem(last=False)
+        if message_id > self.last_seen.get(thread_id, 0):
+            self.last_seen[thread_id] = message_id
+        return True
+    
+    def get(self, thread_id: int) -> Optional[tuple]:
+        return self.routes.get(thread_id)
+    
+    def __len__(self) -> int:
+        return len(self.routes)
+
+class AnswerTickets:
+    """ask_human_async tickets, kept until their answer is collected
+    
+    ticket id (the question's message id) -> [question, future, thread_id,
+    message_id, deadline, thread]. The future is the same one registered in
+    PendingQuestions, so on_message fills it and the answer waits here.
+    """
+    
+    def __init__(self, max_open: int):
+        self.max_open = max_open
+        self.tickets: Dict[str, list] = {}
+    
+    def add(self, ticket_id: str, question: str, future: asyncio.Future, thread_id: int,
+            message_id: Optional[int], deadline: float, thread=None) -> None:
+        self.tickets[ticket_id] = [question, future, thread_id, message_id, deadline, thread]
+    
+    def get(self, ticket_id: str) -> Optional[list]:
+        return self.tickets.get(ticket_id)
+    
+    def pop(self, ticket_id: str) -> Optional[list]:
+        return self.tickets.pop(ticket_id, None)
+    
+    def full(self) -> bool:
+        return len(self.tickets) >= self.max_open
+    
+    def __len__(self) -> int:
+        return len(self.tickets)
+    
+    def __iter__(self):
+        return iter(list(self.tickets))
+
+# Reminder mentions for an unanswered question, in seconds after it was asked
+DEFAULT_REMINDER_INTERVALS = (900.0, 3600.0, 10800.0)
+
+class _Deadline:
+    __slots__ = ("future", "timeout", "on_expire", "remind", "next_reminder", "queued", "forgotten", "trace")
+    
+    def __init__(self, future, timeout, on_expire, remind):
+        self.future = future
+        self.timeout = timeout
+        self.on_expire = on_expire
+        self.remind = remind
+        self.next_reminder = 0  # index into QuestionDeadlines.reminders
+        self.queued = 0  # heap entries still referring to this deadline
+        self.forgotten = False  # future done and its entries counted as stale
+        self.trace = current_trace()  # request / thread that asked, for the reminder's log records
+
+class QuestionDeadlines:
+    """Timeouts and reminder pings for every waiting question, on one timer
+    
+    A heap of (when, seq, deadline, level) with a single loop timer armed for
+    its earliest entry, so waiting questions cost a heap slot each rather than
+    a timer per question. Level 0 expires the question (TimeoutError in its
+    future unless `on_expire` is given); level n posts the n-th reminder via
+    `remind(n)`. Entries of answered or cancelled questions are skipped when
+    they come up and compacted away once they make up half the heap.
+    """
+    
+    def __init__(self, reminders=DEFAULT_REMINDER_INTERVALS):
+        self.reminders = tuple(sorted(reminders))
+        self._heap = []
+        self._seq = itertools.count()
+        self._stale = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_when = None
+        self._loop = None
+    
+    def add(self, future: asyncio.Future, timeout: float, on_expire=None, remind=None) -> None:
+        """Expire `future` after `timeout` seconds, reminding the human in between"""
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop:
+            self._reset(loop)
+        deadline = _Deadline(future, timeout, on_expire, remind)
+        now = loop.time()
+        self._push(now + timeout, deadline, 0)
+        if remind is not None:
+            self._push_reminder(now, deadline)
+        future.add_done_callback(lambda f: self._forget(deadline))
+        self._arm()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"timers": len(self._heap), "stale": self._stale, "reminders": list(self.reminders)}
+    
+    def __len__(self) -> int:
+        return len(self._heap) - self._stale
+    
+    def _reset(self, loop) -> None:
+        # A new event loop (benchmarks run several): futures of the old one are gone
+        if self._timer is not None:
+            self._timer.cancel()
+        self._heap = []
+        self._stale = 0
+        self._timer = self._timer_when = None
+        self._loop = loop
+    
+    def _push(self, when: float, deadline: _Deadline, level: int) -> None:
+        heapq.heappush(self._heap, (when, next(self._seq), deadline, level))
+        deadline.queued += 1
+    
+    def _push_reminder(self, started: float, deadline: _Deadline) -> None:
+        index = deadline.next_reminder
+        if index < len(self.reminders) and self.reminders[index] < deadline.timeout:
+            self._push(started + self.reminders[index], deadline, index + 1)
+    
+    def _forget(self, deadline: _Deadline) -> None:
+        deadline.forgotten = True
+        self._stale += deadline.queued
+        if self._stale > 64 and self._stale * 2 > len(self._heap):
+            live = []
+            for entry in self._heap:
+                if entry[2].future.done():
+                    entry[2].queued -= 1
+                else:
+                    live.append(entry)
+            heapq.heapify(live)
+            self._heap = live
+            self._stale = 0
+            self._arm()
+    
+    def _arm(self) -> None:
+        when = self._heap[0][0] if self._heap else None
+        if when == self._timer_when:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_when = when
+        self._timer = (self._loop.call_at(when, self._fire, context=contextvars.Context())
+                       if when is not None else None)
+    
+    def _fire(self) -> None:
+        self._timer = self._timer_when = None
+        now = self._loop.time()
+        while self._heap and self._heap[0][0] <= now:
+            when, _, deadline, level = heapq.heappop(self._heap)
+            deadline.queued -= 1
+            if deadline.future.done():
+                self._stale -= deadline.forgotten
+                continue
+            if level == 0:
+                if deadline.on_expire is not None:
+                    deadline.on_expire()
+                else:
+                    deadline.future.set_exception(asyncio.TimeoutError())
+            else:
+                deadline.next_reminder = level
+                self._push_reminder(when - self.reminders[level - 1], deadline)
+                asyncio.ensure_future(self._remind(deadline, level))
+        self._arm()
+    
+    async def _remind(self, deadline: _Deadline, level: int) -> None:
+        set_trace(deadline.trace)
+        try:
+            await deadline.remind(level)
+            metrics.inc("human_reminders_total", level=level)
+        except Exception as e:
+            logging.warning("⚠️ Could not send reminder: %s", e)
+
+# Discord send priorities: what the human needs to see first
+PRIORITY_QUESTION = 0
+PRIORITY_REPORT = 1
+PRIORITY_TITLE = 2
+PRIORITY_NAMES = {PRIORITY_QUESTION: "question", PRIORITY_REPORT: "report", PRIORITY_TITLE: "title"}
+
+# Per-route token buckets (requests, per seconds) until Discord's headers say otherwise.
+# Thread renames are limited to 2 per 10 minutes per thread.
+DEFAULT_ROUTE_LIMITS = {
+    "send": (5, 5.0),
+    "create_thread": (5, 5.0),
+    "edit": (2, 600.0),
+    "unarchive": (5, 5.0),  # edit(archived=False) is not subject to the rename limit
+}
+TITLE_EDIT_MAX_AGE_SECONDS = 120.0  # queued title edits older than this are dropped
+RATE_LIMIT_RETRIES = 3
+
+class JobDropped(Exception):
+    """A queued Discord call was superseded or went stale and was not executed"""
+
+class TokenBucket:
+    """Token bucket for one Discord route, adjustable from X-RateLimit-* headers"""
+    
+    def __init__(self, capacity: int, per: float):
+        self.capacity = capacity
+        self.per = per
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+    
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.per)
+        self.updated = now
+    
+    def delay(self, now: float) -> float:
+        """Seconds until a request may be sent on this route"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * self.per / self.capacity
+    
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+    
+    def update_from_headers(self, headers, now: Optional[float] = None) -> None:
+        """Seed the bucket from Discord's X-RateLimit-* / Retry-After response headers"""
+        now = time.monotonic() if now is None else now
+        try:
+            limit = headers.get("X-RateLimit-Limit")
+            remaining = headers.get("X-RateLimit-Remaining")
+            reset_after = headers.get("X-RateLimit-Reset-After") or headers.get("Retry-After")
+            if limit:
+                self.capacity = max(1, int(limit))
+            if reset_after:
+                self.per = max(float(reset_after), 0.001) if limit else self.per
+            if remaining is not None:
+                self.tokens = float(remaining)
+                self.updated = now
+            if reset_after and (remaining is None or int(remaining) == 0):
+                self.blocked_until = now + float(reset_after)
+        except (TypeError, ValueError) as e:
+            logging.debug("Ignoring malformed rate-limit headers: %s", e)
+
+class _Job:
+    __slots__ = ("priority", "route", "call", "stale_key", "future", "submitted", "attempts", "trace")
+    
+    def __init__(self, priority, route, call, stale_key, future):
+        self.priority = priority
+        self.route = route
+        self.call = call
+        self.stale_key = stale_key
+        self.future = future
+        self.submitted = time.monotonic()
+        self.attempts = 0
+        self.trace = current_trace()
+
+class DiscordScheduler:
+    """Single ordered gate in front of thread.send, create_thread and thread.edit
+    
+    Work is taken in priority order (questions, then reports, then title
+    edits), FIFO within a priority, one call at a time per route so messages
+    keep their order. Each route has a token bucket; a 429 refills it from the
+    response headers and the call is retried. A newer title edit for the same
+    thread supersedes a queued one, and title edits that waited too long are
+    dropped. Queue-to-completion latency is kept per priority class.
+    """
+    
+    def __init__(self, route_limits: Optional[Dict[str, tuple]] = None,
+                 title_max_age: float = TITLE_EDIT_MAX_AGE_SECONDS):
+        self.route_limits = dict(DEFAULT_ROUTE_LIMITS, **(route_limits or {}))
+        self.title_max_age = title_max_age
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.latencies = {name: deque(maxlen=1000) for name in PRIORITY_NAMES.values()}
+        self.dropped = 0
+        self._queue = []  # heap of (priority, seq, job)
+        self._seq = itertools.count()
+        self._busy_routes = set()
+        self._latest_stale_key: Dict[Any, _Job] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop = None
+    
+    async def run(self, priority: int, route: str, call, stale_key=None):
+        """Queue `call` (a zero-argument coroutine function) and wait for its result"""
+        return await self.submit(priority, route, call, stale_key)
+    
+    def submit(self, priority: int, route: str, call, stale_key=None) -> asyncio.Future:
+        loop = asyncio.get_event_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._task = spawn_untraced(self._dispatch_loop())
+        
+        job = _Job(priority, route, call, stale_key, loop.create_future())
+        if stale_key is not None:
+            previous = self._latest_stale_key.get(stale_key)
+            if previous is not None and not previous.future.done():
+                self._drop(previous, "superseded")
+            self._latest_stale_key[stale_key] = job
+        heapq.heappush(self._queue, (priority, next(self._seq), job))
+        self._wakeup.set()
+        return job.future
+    
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and latency (seconds) per priority class"""
+        result = {"queued": len(self._queue), "dropped": self.dropped}
+        for name, samples in self.latencies.items():
+            ordered = sorted(samples)
+            result[name] = {
+                "count": len(ordered),
+                "p50": ordered[len(ordered) // 2] if ordered else 0.0,
+                "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] if ordered else 0.0,
+            }
+        return result
+    
+    def bucket(self, route: str) -> TokenBucket:
+        bucket = self.buckets.get(route)
+        if bucket is None:
+            capacity, per = self.route_limits.get(route.split(":", 1)[0], (5, 5.0))
+            bucket = self.buckets[route] = TokenBucket(capacity, per)
+        return bucket
+    
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for _, _, job in self._queue:
+            if not job.future.done():
+                job.future.cancel()
+        self._queue = []
+    
+    def _drop(self, job: _Job, reason: str) -> None:
+        self.dropped += 1
+        metrics.inc("discord_jobs_dropped_total", priority=PRIORITY_NAMES.get(job.priority))
+        if self._latest_stale_key.get(job.stale_key) is job:
+            del self._latest_stale_key[job.stale_key]
+        if not job.future.done():
+            job.future.set_exception(JobDropped(f"{PRIORITY_NAMES.get(job.priority)} job on {job.route} {reason}"))
+            job.future.exception()  # mark retrieved; callers awaiting it still see the exception
+    
+    def _next_job(self, now: float):
+        """Pop the highest-priority runnable job, or return the seconds to wait for one"""
+        wait = None
+        live = []
+        chosen = None
+        for entry in sorted(self._queue):
+            job = entry[2]
+            if job.future.done():
+                continue  # dropped or cancelled by the caller
+            if job.priority == PRIORITY_TITLE and now - job.submitted > self.title_max_age:
+                self._drop(job, "went stale")
+                continue
+            live.append(entry)
+            if chosen is not None or job.route in self._busy_routes:
+                continue
+            delay = self.bucket(job.route).delay(now)
+            if delay <= 0:
+                chosen = entry
+            else:
+                wait = delay if wait is None else min(wait, delay)
+        if chosen is not None:
+            live.remove(chosen)
+        self._queue = live  # sorted lists are valid heaps
+        return (chosen[2] if chosen else None), wait
+    
+    async def _dispatch_loop(self) -> None:
+        while True:
+            now = time.monotonic()
+            job, wait = self._next_job(now)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.bucket(job.route).take(now)
+            self._busy_routes.add(job.route)
+            asyncio.ensure_future(self._execute(job))
+    
+    async def _execute(self, job: _Job) -> None:
+        set_trace(job.trace)  # this task only: log records name the call that submitted the job
+        requeue = False
+        kind = job.route.split(":", 1)[0]
+        started = time.perf_counter()
+        try:
+            job.attempts += 1
+            result = await job.call()
+        except discord.HTTPException as e:
+            metrics.inc("discord_api_errors_total", route=kind, status=e.status)
+            headers = getattr(getattr(e, "response", None), "headers", None)
+            if headers:
+                self.bucket(job.route).update_from_headers(headers)
+            if e.status == 429 and job.attempts <= RATE_LIMIT_RETRIES:
+                metrics.inc("discord_rate_limited_total", route=kind)
+                logging.warning("⏳ Rate limited on %s, retrying", job.route)
+                requeue = True
+            elif not job.future.done():
+                job.future.set_exception(e)
+        except Exception as e:
+            metrics.inc("discord_api_errors_total", route=kind, status="exception")
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            metrics.observe("discord_api_seconds", time.perf_counter() - started, route=kind)
+            self._busy_routes.discard(job.route)
+            if requeue:
+                heapq.heappush(self._queue, (job.priority, next(self._seq), job))
+            else:
+                if job.stale_key is not None and self._latest_stale_key.get(job.stale_key) is job:
+                    del self._latest_stale_key[job.stale_key]
+                priority = PRIORITY_NAMES.get(job.priority, "other")
+                self.latencies[priority].append(time.monotonic() - job.submitted)
+                metrics.observe("discord_send_latency_seconds", time.monotonic() - job.submitted, priority=priority)
+            self._wakeup.set()
+
+class ReadyGate:
+    """Set once the Discord gateway is ready; tool calls that need Discord wait on it
+    
+    MCP initialize / tools/list are answered without waiting, so the client
+    does not sit through the gateway handshake before it can list tools.
+    """
+    
+    def __init__(self):
+        self._ready = False
+        self._waiters = []
+    
+    def is_set(self) -> bool:
+        return self._ready
+    
+    def set(self) -> None:
+        self._ready = True
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters = []
+    
+    async def wait(self, timeout: Optional[float] = None) -> None:
+        """Return once ready; raises asyncio.TimeoutError after `timeout` seconds"""
+        if self._ready:
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            metrics.observe("discord_ready_wait_seconds", time.perf_counter() - started)
+
+# Resolved users / channels / threads are reused for this long before being looked up again
+RESOLVE_CACHE_TTL_SECONDS = 300.0
+
+class DiscordObjectCache:
+    """TTL cache of resolved Discord users and channels (threads included)
+    
+    Lookups try the cache, then the gateway's local cache (free), then one
+    REST fetch; only successful lookups are cached.
+    """
+    
+    def __init__(self, ttl: float = RESOLVE_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries: Dict[tuple, tuple] = {}  # (kind, id) -> (expires, object)
+    
+    def get(self, kind: str, object_id: int):
+        entry = self._entries.get((kind, object_id))
+        if entry and entry[0] > time.monotonic():
+            metrics.inc("discord_resolve_total", kind=kind, source="cache")
+            return entry[1]
+        return None
+    
+    def put(self, kind: str, obj) -> None:
+        self._entries[(kind, obj.id)] = (time.monotonic() + self.ttl, obj)
+    
+    def invalidate(self, kind: str, object_id: int) -> None:
+        self._entries.pop((kind, object_id), None)
+    
+    async def user(self, client, user_id: int):
+        return await self._resolve("user", user_id, client.get_user, client.fetch_user)
+    
+    async def channel(self, client, channel_id: int):
+        return await self._resolve("channel", channel_id, client.get_channel, client.fetch_channel)
+    
+    async def _resolve(self, kind: str, object_id: int, get, fetch):
+        obj = self.get(kind, object_id)
+        if obj is not None:
+            return obj
+        obj = get(object_id)
+        source = "gateway"
+        if obj is None:
+            source = "rest"
+            try:
+                with metrics.timer("discord_fetch_seconds", kind=kind):
+                    obj = await fetch(object_id)
+            except (discord.NotFound, discord.Forbidden) as e:
+                logging.warning("⚠️ Could not fetch %s %s: %s", kind, object_id, e)
+                obj = None
+        metrics.inc("discord_resolve_total", kind=kind, source=source if obj is not None else "missing")
+        if obj is not None:
+            self.put(kind, obj)
+        return obj
+
+_startup_marks: Dict[str, float] = {}
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+def mark_startup(event: str) -> None:
+    """Record (once) how long after process start `event` happened"""
+    if event in _startup_marks:
+        return
+    elapsed = time.perf_counter() - PROCESS_STARTED
+    _startup_marks[event] = elapsed
+    metrics.set_gauge("startup_seconds", elapsed, event=event)
+    logging.info("⏱️ %s %.0f ms after start", event, elapsed * 1000)
 
 # Global state
-pending_questions = {}
+metrics = Metrics()
+pending_questions = PendingQuestions()
+thread_routes = ThreadRoutes()
+discord_scheduler = DiscordScheduler()
+discord_ready = ReadyGate()
+question_deadlines = QuestionDeadlines()
+discord_objects = DiscordObjectCache()
 discord_client = None
+client_cancelled: set = set()  # request tasks cancelled by notifications/cancelled (not by shutdown)
+
+def cancelled_by_client() -> bool:
+    """True inside a request task the MCP client itself cancelled"""
+    return asyncio.current_task() in client_cancelled
+
+# The --max-concurrent-tool-calls slot held by the tool call running in this task, if any
+tool_call_slot: contextvars.ContextVar = contextvars.ContextVar("tool_call_slot", default=None)
+
+def release_tool_call_slot() -> None:
+    """Give this tool call's slot back: what is left is waiting on the human, not Discord work"""
+    slot = tool_call_slot.get()
+    if slot is not None:
+        tool_call_slot.set(None)
+        slot.release()
+
+# How long tool calls wait for the Discord gateway before failing
+DISCORD_READY_TIMEOUT_SECONDS = 60.0
+
+# Upper bound on tools/call requests running at the same time
+DEFAULT_MAX_CONCURRENT_TOOL_CALLS = 8
+
+# Daemon mode: MCP clients served at once by one gateway connection
+DAEMON_MAX_CLIENTS = 64
+DAEMON_DRAIN_SECONDS = 5.0  # after a client's EOF, before its unfinished requests are cancelled
+
+# Reconnect recovery: history page size, and the most messages read back per thread
+RECOVERY_PAGE_SIZE = 100
+RECOVERY_MAX_MESSAGES = 1000
+
+# stdio framing: StreamReader buffer size, and the largest JSON-RPC line we accept
+STDIO_READ_LIMIT = 64 * 1024
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+# ask_human waits this long for an answer (unless the call passes `timeout`)
+ASK_TIMEOUT_SECONDS = 21600
+
+# Reminder mentions, escalating; later reminders reuse the last one
+REMINDER_MESSAGES = (
+    "🔔 {mention} 質問への回答をお待ちしています",
+    "⏰ {mention} まだ回答をお待ちしています（{elapsed}経過）",
+    "🚨 {mention} 至急ご確認ください：質問が{elapsed}未回答です",
+)
+
+# ask_human_many: most questions posted in one call
+ASK_MANY_MAX_QUESTIONS = 20
+
+# ask_human_async: uncollected tickets per session, and the longest single wait_human_response
+MAX_OPEN_TICKETS = 100
+TICKET_WAIT_DEFAULT_SECONDS = 60.0
+TICKET_WAIT_MAX_SECONDS = 600.0
+
+# Number of recent messages the title logic looks at (3 exchanges)
+TITLE_WINDOW_MESSAGES = 6
+
+# Title generation runs in the background: wait for a quiet period, bound each Gemini call
+TITLE_DEBOUNCE_SECONDS = 5.0
+TITLE_TIMEOUT_SECONDS = 10.0
+TITLE_CACHE_SIZE = 256
+GEMINI_MODEL_NAME = 'gemini-2.0-flash-exp'
+
+# report_to_human batching: Discord's per-message limit, merge window, queue bound
+DISCORD_MESSAGE_LIMIT = 2000
+REPORT_FLUSH_SECONDS = 0.5
+REPORT_QUEUE_SIZE = 100
+REPORT_OVERFLOW_POLICIES = ("merge", "drop")
+
+# Fallback title keywords (override with --title-keywords / TITLE_KEYWORDS_FILE, a JSON file of the same shape)
+DEFAULT_TITLE_KEYWORDS = {
+    "tech": ['python', 'discord', 'error', 'bug', 'api', 'code', 'function', '問題', 'エラー'],
+    "action": ['作成', 'create', '修正', 'fix', '実装', 'implement', '解決', 'solve'],
+}
+
+# Egress: text longer than this goes out as a file attachment instead of chunks,
+# and attachments at least this large are gzip-compressed (0 disables compression)
+ATTACHMENT_THRESHOLD_CHARS = 6000
+ATTACHMENT_GZIP_BYTES = 4 * 1024 * 1024
+ATTACHMENT_PREVIEW_CHARS = 300
+
+# In-memory conversation window; older entries spill to the history log
+HISTORY_MAX_MESSAGES = 100
+HISTORY_MAX_BYTES = 1024 * 1024
+
+_gemini_model = None  # Configured once, shared by every title request
+_title_cache: "OrderedDict[str, str]" = OrderedDict()  # sha1(conversation window) -> title
+
+def load_genai():
+    """Import the Gemini SDK on the first title request (slow import, kept off the startup path)"""
+    global genai, _genai_checked
+    if not _genai_checked:
+        _genai_checked = True
+        try:
+            import google.generativeai as genai_module
+            genai = genai_module
+        except ImportError:
+            logging.warning("Google AI SDK not available - title generation will use fallback method")
+    return genai
+
+def get_gemini_model():
+    """Return the shared Gemini model, configuring the SDK on first use"""
+    global _gemini_model
+    if _gemini_model is None:
+        api_key = os.getenv('GOOGLE_AI_API_KEY')
+        if not api_key or not load_genai():
+            return None
+        genai.configure(api_key=api_key)
+        _gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    return _gemini_model
+
+class TitleWorker:
+    """Background thread-title updates, debounced and coalesced per thread
+    
+    Tool calls only call schedule(); the update itself (Gemini + thread.edit)
+    runs once the thread has been quiet for `debounce` seconds. Requests that
+    arrive while an update is running are folded into one follow-up run.
+    """
+    
+    def __init__(self, update, debounce: float = TITLE_DEBOUNCE_SECONDS):
+        self.update = update  # async callable taking the thread
+        self.debounce = debounce
+        self._timers: Dict[int, asyncio.Task] = {}  # thread id -> debounce task
+        self._running: Dict[int, asyncio.Task] = {}  # thread id -> update in progress
+        self._rerun: Dict[int, Any] = {}  # thread id -> latest thread object to redo after the running update
+    
+    def schedule(self, thread) -> None:
+        thread_id = thread.id
+        if thread_id in self._running:
+            self._rerun[thread_id] = thread
+            return
+        timer = self._timers.pop(thread_id, None)
+        if timer:
+            timer.cancel()
+        self._timers[thread_id] = spawn_untraced(self._after_quiet_period(thread))
+    
+    async def close(self) -> None:
+        tasks = list(self._timers.values()) + list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _after_quiet_period(self, thread) -> None:
+        await asyncio.sleep(self.debounce)
+        thread_id = thread.id
+        log_thread_id.set(thread_id)
+        self._timers.pop(thread_id, None)
+        self._running[thread_id] = asyncio.ensure_future(self.update(thread))
+        try:
+            await self._running[thread_id]
+        except Exception as e:
+            logging.error("❌ Title update failed: %s", e)
+        finally:
+            del self._running[thread_id]
+            latest = self._rerun.pop(thread_id, None)
+            if latest is not None:
+                self.schedule(latest)
+
+class SessionStore:
+    """SQLite-backed state for one (channel, user, session) triple
+    
+    Keeps the thread, title, recent history and unanswered questions so a
+    restarted server reuses its thread and keeps waiting for answers without
+    any Discord API call. Everything is keyed by channel, user and session name.
+    """
+    
+    def __init__(self, path: str, channel_id: int, user_id: int, session: str = "default"):
+        self.key = (channel_id, user_id, session)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                channel_id INTEGER, user_id INTEGER, session TEXT,
+                thread_id INTEGER, thread_title TEXT, is_forum INTEGER,
+                conversation_count INTEGER, history TEXT,
+                PRIMARY KEY (channel_id, user_id, session))""")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS questions (
+                message_id INTEGER PRIMARY KEY,
+                channel_id INTEGER, user_id INTEGER, session TEXT,
+                thread_id INTEGER, question TEXT, answer TEXT, asked_at REAL)""")
+    
+    def load(self) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute(
+            "SELECT thread_id, thread_title, is_forum, conversation_count, history FROM sessions "
+            "WHERE channel_id = ? AND user_id = ? AND session = ?", self.key).fetchone()
+        if not row:
+            return None
+        return {
+            "thread_id": row[0],
+            "thread_title": row[1],
+            "is_forum": None if row[2] is None else bool(row[2]),
+            "conversation_count": row[3] or 0,
+            "history": json.loads(row[4] or "[]"),
+        }
+    
+    def save(self, thread_id, thread_title, is_forum, conversation_count: int, history: list) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self.key + (thread_id, thread_title, None if is_forum is None else int(is_forum),
+                            conversation_count, json.dumps(history, ensure_ascii=False)))
+    
+    def pending_questions(self) -> list:
+        """Unanswered or uncollected questions as (message_id, thread_id, question, answer, asked_at)"""
+        return self.conn.execute(
+            "SELECT message_id, thread_id, question, answer, asked_at FROM questions "
+            "WHERE channel_id = ? AND user_id = ? AND session = ? ORDER BY asked_at", self.key).fetchall()
+    
+    def add_question(self, message_id: int, thread_id: int, question: str) -> None:
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO questions VALUES (?, ?, ?, ?, ?, ?, NULL, ?)",
+                              (message_id,) + self.key + (thread_id, question, time.time()))
+    
+    def answer_question(self, message_id: int, answer: str) -> None:
+        with self.conn:
+            self.conn.execute("UPDATE questions SET answer = ? WHERE message_id = ?", (answer, message_id))
+    
+    def remove_question(self, message_id: int) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM questions WHERE message_id = ?", (message_id,))
+    
+    def prune_questions(self, older_than: float) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM questions WHERE channel_id = ? AND user_id = ? AND session = ? "
+                              "AND asked_at < ?", self.key + (older_than,))
+    
+    def close(self) -> None:
+        self.conn.close()
+
+def describe_duration(seconds: float) -> str:
+    """21600 -> "6 hours", 90 -> "90 seconds" (for timeout messages)"""
+    for unit, size in (("hour", 3600), ("minute", 60)):
+        if seconds >= size and seconds % size == 0:
+            count = int(seconds // size)
+            return f"{count} {unit}{'s' if count != 1 else ''}"
+    return f"{seconds:g} seconds"
+
+# A line opening a code block: ``` and an optional info string without backticks
+OPENING_FENCE = re.compile(r"```[^`]*")
+
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> list:
+    """Split text into chunks of at most `limit` characters
+    
+    Splits on line boundaries (hard-splitting only lines that are themselves
+    too long) and keeps ``` code fences balanced: a chunk that ends inside a
+    code block closes it and the next chunk reopens it with the same header
+    (a bare ``` when the header would take more than a quarter of the limit).
+    Only a line that is exactly a fence opens or closes a block; inline
+    ```code``` on one line does not.
+    """
+    if len(text) <= limit:
+        return [text]
+    
+    closing = "\n```"
+    chunks = []
+    current = []
+    size = 0
+    fence = None  # header reopening the code block we are in, e.g. "```python"
+    
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if fence:
+            is_fence = stripped == "```"
+        else:
+            # A fence line that must itself be hard-split cannot open a block in any chunk
+            is_fence = len(line) + len(closing) <= limit and OPENING_FENCE.fullmatch(stripped) is not None
+        if is_fence and fence and "".join(current).strip() == fence:
+            # Split right before the closing fence: drop the reopened header instead of an empty block
+            current, size, fence = [], 0, None
+            continue
+        # Room for "\n```" is only needed while the text after this line is inside a code block
+        if is_fence:
+            fence_after = None if fence else (stripped if len(stripped) + 1 <= limit // 4 else "```")
+        else:
+            fence_after = fence
+        reserve = len(closing) if fence_after else 0
+        header = len(fence) + 1 if fence else 0
+        budget = max(1, limit - reserve - header)
+        for start in range(0, len(line), budget):
+            piece = line[start:start + budget]
+            if current and size + len(piece) + reserve > limit:
+                body = "".join(current)
+                if body.strip() and body.strip() != fence:  # nothing but blank lines (and a reopened fence)
+                    chunks.append(body.rstrip("\n") + closing if fence else body)
+                current = [fence + "\n"] if fence else []
+                size = header
+            current.append(piece)
+            size += len(piece)
+        fence = fence_after
+    
+    if current and "".join(current).strip():
+        chunks.append("".join(current))
+    return chunks
+
+def encode_attachment(text: str, gzip_bytes: int = ATTACHMENT_GZIP_BYTES):
+    """Encode a payload for upload once; returns (bytes, filename)"""
+    data = text.encode("utf-8")
+    if gzip_bytes and len(data) >= gzip_bytes:
+        return gzip.compress(data, compresslevel=6), "message.txt.gz"
+    return data, "message.txt"
+
+class ReportQueue:
+    """Bounded outbound queue for report_to_human
+    
+    put() returns immediately; a sender task waits `flush_window` seconds so
+    bursts arrive together, then sends them merged into as few messages as fit
+    in Discord's 2000-character limit. When the queue is full the "merge"
+    policy appends the report to the newest entry and "drop" discards the oldest.
+    """
+    
+    def __init__(self, send, flush_window: float = REPORT_FLUSH_SECONDS, max_size: int = REPORT_QUEUE_SIZE,
+                 overflow: str = "merge"):
+        if overflow not in REPORT_OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        if max_size < 1:
+            raise ValueError(f"Report queue size must be at least 1, got {max_size}")
+        self.send = send  # async callable taking the merged text
+        self.flush_window = flush_window
+        self.max_size = max_size
+        self.overflow = overflow
+        self.dropped = 0
+        self.merged = 0
+        self._queue = deque()  # [text, request ids merged into it]
+        self._flush_requested = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+    
+    def stats(self) -> Dict[str, int]:
+        return {"depth": self.depth, "dropped": self.dropped, "merged": self.merged}
+    
+    def put(self, text: str) -> None:
+        if len(self._queue) >= self.max_size:
+            if self.overflow == "merge":
+                newest = self._queue[-1]
+                newest[0] = f"{newest[0]}\n{text}"
+                newest[1].append(log_request_id.get())
+                self.merged += 1
+                metrics.inc("report_queue_overflow_total", policy="merge")
+                return
+            self._queue.popleft()
+            self.dropped += 1
+            metrics.inc("report_queue_overflow_total", policy="drop")
+            metrics.add_gauge("report_queue_depth", -1)
+            logging.warning("⚠️ Report queue full (%s), dropped oldest report", self.max_size)
+        self._queue.append([text, [log_request_id.get()]])
+        metrics.add_gauge("report_queue_depth", 1)
+        if self._task is None:
+            self._idle.clear()
+            self._task = spawn_untraced(self._run())
+    
+    async def flush(self) -> None:
+        """Send everything queued now, without waiting for the flush window"""
+        if self._task is None:
+            return
+        self._flush_requested.set()
+        await self._idle.wait()
+    
+    async def close(self) -> None:
+        await self.flush()
+    
+    def _take_batch(self) -> tuple:
+        """(merged text, ids of the requests that reported it)"""
+        parts = [self._queue.popleft()]
+        size = len(parts[0][0])
+        while self._queue and size + 1 + len(self._queue[0][0]) <= DISCORD_MESSAGE_LIMIT:
+            size += 1 + len(self._queue[0][0])
+            parts.append(self._queue.popleft())
+        metrics.add_gauge("report_queue_depth", -len(parts))
+        metrics.inc("report_batches_total")
+        request_ids = [request_id for part in parts for request_id in part[1]]
+        return "\n".join(part[0] for part in parts), request_ids
+    
+    async def _run(self) -> None:
+        try:
+            while self._queue:
+                try:
+                    await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_window)
+                except asyncio.TimeoutError:
+                    pass
+                self._flush_requested.clear()
+                while self._queue:
+                    batch, request_ids = self._take_batch()
+                    # One id, or every id merged into this message
+                    log_request_id.set(request_ids[0] if len(request_ids) == 1 else request_ids)
+                    try:
+                        await self.send(batch)
+                    except Exception as e:
+                        logging.error("❌ Failed to send report: %s", e)
+        finally:
+            self._task = None
+            self._idle.set()
+
+def load_title_keywords(path: Optional[str]) -> Dict[str, list]:
+    """Read fallback-title keywords from a JSON file, or return the defaults"""
+    if not path:
+        return DEFAULT_TITLE_KEYWORDS
+    with open(path, "r", encoding="utf-8") as fh:
+        keywords = json.load(fh)
+    return {category: list(keywords.get(category, [])) for category in DEFAULT_TITLE_KEYWORDS}
+
+class KeywordIndex:
+    """Incremental keyword frequencies over the title window
+    
+    All keywords are compiled once into a single case-insensitive regex
+    alternation with one named group per keyword, so a match maps back to
+    its keyword however case folding changed the text. Each message is scanned once, when it arrives; its counts
+    are added to running totals and subtracted again when it leaves the
+    window, so a fallback title never rescans the history.
+    """
+    
+    def __init__(self, keywords: Optional[Dict[str, list]] = None, window: int = TITLE_WINDOW_MESSAGES):
+        keywords = keywords or DEFAULT_TITLE_KEYWORDS
+        self.window = window
+        self._lookup = {}  # lowercased keyword -> (category, keyword as configured, rank within category)
+        for category, words in keywords.items():
+            for rank, word in enumerate(words):
+                self._lookup.setdefault(word.lower(), (category, word, rank))
+        # Longest first so overlapping keywords prefer the more specific one
+        ordered = sorted(self._lookup, key=len, reverse=True)
+        self._groups = {f"k{i}": word for i, word in enumerate(ordered)}  # group name -> lowercased keyword
+        alternation = "|".join(f"(?P<k{i}>{re.escape(word)})" for i, word in enumerate(ordered))
+        self._pattern = re.compile(alternation, re.IGNORECASE) if alternation else None
+        self.counts: Dict[str, Counter] = {category: Counter() for category in keywords}
+        self._entries = deque()  # (Counter of matched keywords, first question sentence or None)
+    
+    def observe(self, message: str) -> None:
+        found = Counter()
+        if self._pattern:
+            for match in self._pattern.finditer(message):
+                found[self._groups[match.lastgroup]] += 1
+        self._entries.append((found, self._first_question(message)))
+        self._apply(found, 1)
+        if len(self._entries) > self.window:
+            old, _ = self._entries.popleft()
+            self._apply(old, -1)
+    
+    def top(self, category: str) -> Optional[str]:
+        """Most frequent keyword of a category in the window (ties: configured order)"""
+        counts = self.counts.get(category)
+        if not counts:
+            return None
+        best = max(counts, key=lambda word: (counts[word], -self._lookup[word][2]))
+        return self._lookup[best][1]
+    
+    def title(self) -> str:
+        tech = self.top("tech")
+        action = self.top("action")
+        if tech and action:
+            return f"{action} {tech}"[:100]
+        if tech:
+            return f"{tech}について"
+        # Extract first question from the oldest messages in the window
+        for _, question in itertools.islice(self._entries, 3):
+            if question:
+                return question
+        return "AI Assistant Question"  # Final fallback
+    
+    def _apply(self, found: Counter, sign: int) -> None:
+        for word, count in found.items():
+            counts = self.counts[self._lookup[word][0]]
+            counts[word] += sign * count
+            if counts[word] <= 0:
+                del counts[word]
+    
+    @staticmethod
+    def _first_question(message: str) -> Optional[str]:
+        if '?' not in message and '？' not in message:
+            return None
+        for sentence in message.split('。'):
+            if '?' in sentence or '？' in sentence:
+                return sentence.strip().replace('\n', ' ')[:100]
+        return None
+
+class ConversationHistory:
+    """Conversation window bounded by message count and UTF-8 bytes
+    
+    Entries pushed out of the in-memory window are appended to a JSON-lines
+    log when `log_path` is set (otherwise they are dropped), so memory stays
+    flat however long the session runs. iter_archive() reads the log back
+    lazily, one entry at a time.
+    """
+    
+    def __init__(self, max_messages: int = HISTORY_MAX_MESSAGES, max_bytes: int = HISTORY_MAX_BYTES,
+                 log_path: Optional[str] = None):
+        self.max_messages = max(1, max_messages)
+        self.max_bytes = max_bytes
+        self.log_path = log_path
+        self.spilled = 0
+        self._entries = deque()  # (text, size in bytes)
+        self._bytes = 0
+        self._log = None
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def __iter__(self):
+        return (text for text, _ in self._entries)
+    
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+    
+    def append(self, text: str) -> None:
+        size = len(text.encode("utf-8"))
+        self._entries.append((text, size))
+        self._bytes += size
+        # Always keep the newest entry, even if it alone exceeds the byte budget
+        while len(self._entries) > 1 and (len(self._entries) > self.max_messages or self._bytes > self.max_bytes):
+            old_text, old_size = self._entries.popleft()
+            self._bytes -= old_size
+            self._spill(old_text)
+    
+    def extend(self, texts) -> None:
+        for text in texts:
+            self.append(text)
+    
+    def recent(self, count: int) -> list:
+        """The newest `count` entries, oldest first"""
+        if count >= len(self._entries):
+            return [text for text, _ in self._entries]
+        return [text for text, _ in itertools.islice(self._entries, len(self._entries) - count, None)]
+    
+    def iter_archive(self):
+        """Lazily yield {"ts", "text"} records spilled to the log, oldest first"""
+        if not self.log_path or not os.path.exists(self.log_path):
+            return
+        if self._log:
+            self._log.flush()
+        with open(self.log_path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+    
+    def close(self) -> None:
+        if self._log:
+            self._log.close()
+            self._log = None
+    
+    def _spill(self, text: str) -> None:
+        self.spilled += 1
+        if not self.log_path:
+            return
+        if self._log is None:
+            self._log = open(self.log_path, "a", encoding="utf-8")
+        self._log.write(json.dumps({"ts": time.time(), "text": text}, ensure_ascii=False) + "\n")
+        self._log.flush()
 
 class HumanInDiscord:
     """Discord-based human interaction handler"""
     
-    def __init__(self, client, channel_id: int, user_id: int):
+    def __init__(self, client, channel_id: int, user_id: int, store: Optional[SessionStore] = None,
+                 report_flush_seconds: float = REPORT_FLUSH_SECONDS, report_queue_size: int = REPORT_QUEUE_SIZE,
+                 report_overflow: str = "merge", history: Optional[ConversationHistory] = None,
+                 attachment_threshold: int = ATTACHMENT_THRESHOLD_CHARS,
+                 attachment_gzip_bytes: int = ATTACHMENT_GZIP_BYTES,
+                 title_keywords: Optional[Dict[str, list]] = None,
+                 ready_timeout: float = DISCORD_READY_TIMEOUT_SECONDS,
+                 responder_ids=()):
         self.client = client
         self.channel_id = channel_id
         self.user_id = user_id
+        self.responder_ids = frozenset({user_id, *responder_ids})  # who may answer in this session's threads
+        self._routed_threads = set()  # thread ids this session registered in thread_routes
         self.thread_id = None  # Persistent thread like Rust OnceCell
         self.thread_title = None
         self.is_forum = None  # Cache for channel type
         self.conversation_count = 0  # Track conversation exchanges
-        self.conversation_history = []  # Store conversation for title generation
+        self.conversation_history = history or ConversationHistory()  # Bounded window for title generation
+        self.keyword_index = KeywordIndex(title_keywords)  # Fallback titles, updated as messages arrive
+        self._thread_lock = asyncio.Lock()  # Concurrent tool calls must not create two threads
+        self._starter_message_id = None  # Forum starter message carrying the first question
+        self._text_delivered = False  # True when a new forum thread's starter message already holds the text
+        self.attachment_threshold = attachment_threshold
+        self.attachment_gzip_bytes = attachment_gzip_bytes
+        self.store = store  # Optional persistence across restarts
+        self._restored_questions: Dict[str, tuple] = {}  # question text -> (thread_id, message_id, future, deadline)
+        self.title_worker = TitleWorker(self.update_thread_title_if_needed)
+        self.reports = ReportQueue(self._send_report, report_flush_seconds, report_queue_size, report_overflow)
+        self._title_due = False  # Set by report_message, consumed once the report reaches the thread
+        self.ready_timeout = ready_timeout  # Seconds to wait for the gateway before a Discord call fails
+        self.tickets = AnswerTickets(MAX_OPEN_TICKETS)  # ask_human_async questions until collected
+    
+    def restore(self) -> None:
+        """Reload thread and waiting questions from the session store (no Discord API calls)"""
+        if not self.store:
+            return
+        state = self.store.load()
+        if state:
+            self.thread_id = state["thread_id"]
+            self.thread_title = state["thread_title"]
+            self.is_forum = state["is_forum"]
+            self.conversation_count = state["conversation_count"]
+            self._route_thread(self.thread_id)
+            self.conversation_history.extend(state["history"])
+            for text in state["history"]:
+                self.keyword_index.observe(text)
+            logging.info("♻️ Restored session: thread=%s title='%s'", self.thread_id, self.thread_title)
+        
+        now = time.time()
+        self.store.prune_questions(now - ASK_TIMEOUT_SECONDS)
+        loop = asyncio.get_event_loop()
+        for message_id, thread_id, question, answer, asked_at in self.store.pending_questions():
+            future = loop.create_future()
+            if answer is not None:
+                # Answered after the previous process stopped waiting; hand it out on the next ask
+                future.set_result(answer)
+            else:
+                # Re-attach so the answer is captured (and persisted) even before the agent asks again
+                # Replies to it only: its agent may be gone, and plain messages belong to live questions
+                pending_questions.add(thread_id, future, replies_only=True)
+                pending_questions.link_message(thread_id, future, message_id)
+                self._route_thread(thread_id)
+                future.add_done_callback(lambda f, m=message_id: self._persist_answer(m, f))
+            self._restored_questions.setdefault(question, (thread_id, message_id, future, asked_at + ASK_TIMEOUT_SECONDS))
+            self.tickets.add(str(message_id), question, future, thread_id, message_id, asked_at + ASK_TIMEOUT_SECONDS)
+            if not future.done():
+                question_deadlines.add(future, max(0.0, asked_at + ASK_TIMEOUT_SECONDS - now),
+                                       on_expire=functools.partial(self._expire_ticket, str(message_id), future))
+        if self._restored_questions:
+            logging.info("♻️ Re-attached %s waiting question(s)", len(self._restored_questions))
+            if discord_ready.is_set():
+                # Daemon client restored after on_ready: its answers may already be in the thread
+                asyncio.ensure_future(recover_missed_answers(self.client, "restore"))
+    
+    async def close(self) -> None:
+        """Flush queued reports and release per-session state (daemon clients disconnecting)"""
+        await self.reports.close()
+        await self.title_worker.close()
+        # Nobody can collect these any more: cancelling also retires their deadlines and reminders.
+        # With a session store they stay stored and the next connection re-attaches them.
+        for thread_id, message_id, future, deadline in self._restored_questions.values():
+            pending_questions.discard(thread_id, future)
+            future.cancel()
+        self._restored_questions.clear()
+        for ticket_id in self.tickets:
+            question, future, thread_id, message_id, deadline, thread = self.tickets.pop(ticket_id)
+            pending_questions.discard(thread_id, future)
+            future.cancel()
+        for thread_id in self._routed_threads:
+            thread_routes.unregister(thread_id, self)
+        self._routed_threads.clear()
+        self.conversation_history.close()
+        if self.store:
+            self.store.close()
+    
+    def _route_thread(self, thread_id: Optional[int]) -> None:
+        """Let on_message deliver this thread's replies from our responders"""
+        if thread_id:
+            thread_routes.register(thread_id, self, self.responder_ids)
+            self._routed_threads.add(thread_id)
+    
+    def _persist_answer(self, message_id: int, future: asyncio.Future) -> None:
+        if self.store and not future.cancelled():
+            self.store.answer_question(message_id, future.result())
+    
+    async def _remind(self, thread_id: int, message_id: Optional[int], asked: float, level: int,
+                      future: Optional[asyncio.Future] = None, note: str = "") -> None:
+        """QuestionDeadlines callback: mention the user, replying to the question message"""
+        thread = await discord_objects.channel(self.client, thread_id)
+        if thread is None:
+            return
+        template = REMINDER_MESSAGES[min(level, len(REMINDER_MESSAGES)) - 1]
+        elapsed = time.monotonic() - asked
+        content = template.format(mention=f"<@{self.user_id}>",
+                                  elapsed=f"{elapsed / 3600:.1f} 時間" if elapsed >= 3600 else f"{elapsed // 60:.0f} 分") + note
+        options = {}
+        if message_id:
+            options["reference"] = discord.MessageReference(message_id=message_id, channel_id=thread_id,
+                                                            fail_if_not_exists=False)
+        sent = await discord_scheduler.run(PRIORITY_QUESTION, f"send:{thread_id}",
+                                           functools.partial(thread.send, content, **options))
+        if future is not None:
+            pending_questions.link_message(thread_id, future, sent.id)  # a reply to the reminder answers too
+    
+    def _save_state(self) -> None:
+        if self.store:
+            self.store.save(self.thread_id, self.thread_title, self.is_forum, self.conversation_count,
+                            self.conversation_history.recent(TITLE_WINDOW_MESSAGES))
+    
+    def _remember(self, text: str) -> None:
+        """Add a message to the conversation history (for title updates)"""
+        self.conversation_history.append(text)
+        self.keyword_index.observe(text)
+        self.conversation_count += 1
+        self._save_state()
     
     def create_thread_name(self, question: str) -> str:
         """Create a valid Discord thread name (1-100 characters)"""
@@ -84,11 +1664,11 @@ class HumanInDiscord:
     
     async def analyze_conversation_for_title(self) -> str:
         """Analyze conversation history to generate a better title using Gemini AI"""
-        if len(self.conversation_history) < 6:  # Need at least 3 exchanges (6 messages)
+        if self.conversation_count < TITLE_WINDOW_MESSAGES:  # Need at least 3 exchanges (6 messages)
             return None
             
         # Get latest 6 messages for analysis
-        recent_messages = self.conversation_history[-6:]
+        recent_messages = self.conversation_history.recent(TITLE_WINDOW_MESSAGES)
         conversation_text = "\n".join([f"Message {i+1}: {msg}" for i, msg in enumerate(recent_messages)])
         
         # Try AI-powered title generation first
@@ -97,24 +1677,26 @@ class HumanInDiscord:
             return ai_title
             
         # Fallback to simple keyword extraction
-        return self._fallback_title_generation(recent_messages)
+        return self._fallback_title_generation()
     
     async def _generate_ai_title(self, conversation_text: str) -> Optional[str]:
         """Generate title using Gemini 2.0 Flash API"""
-        if not genai:
-            logging.warning("Google AI SDK not available for title generation")
-            return None
+        if not os.getenv('GOOGLE_AI_API_KEY'):
+            return None  # no key: don't pay for the SDK import
+        
+        cache_key = hashlib.sha1(conversation_text.encode("utf-8")).hexdigest()
+        cached = _title_cache.get(cache_key)
+        if cached:
+            _title_cache.move_to_end(cache_key)
+            metrics.inc("title_cache_hits_total")
+            return cached
             
         try:
-            # Get API key from environment
-            api_key = os.getenv('GOOGLE_AI_API_KEY')
-            if not api_key:
+            # Shared client, configured on first use
+            model = get_gemini_model()
+            if not model:
                 logging.warning("GOOGLE_AI_API_KEY not found in environment variables")
                 return None
-                
-            # Initialize Gemini client
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-2.0-flash-exp')
             
             # Prepare prompt for title generation
             prompt = f"""以下の会話から短くて分かりやすいタイトルを作成してください。
@@ -130,71 +1712,94 @@ class HumanInDiscord:
 
 回答例: Python Discord Bot開発"""
             
-            # Generate title using Gemini 2.0 Flash
-            response = await asyncio.get_event_loop().run_in_executor(
-                None, 
-                lambda: model.generate_content(prompt)
-            )
+            # Generate title using Gemini 2.0 Flash (native async API, no thread-pool worker)
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                response = await asyncio.wait_for(model.generate_content_async(prompt), timeout=TITLE_TIMEOUT_SECONDS)
+                outcome = "ok"
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                raise
+            finally:
+                metrics.observe("gemini_title_seconds", time.perf_counter() - started, outcome=outcome)
             
             if response and response.text:
                 title = response.text.strip()
                 # Ensure title length is within Discord limits
                 if len(title) > 100:
                     title = title[:100]
-                logging.info(f"🤖 AI-generated title: {title}")
+                logging.info("🤖 AI-generated title: %s", title)
+                _title_cache[cache_key] = title
+                if len(_title_cache) > TITLE_CACHE_SIZE:
+                    _title_cache.popitem(last=False)
                 return title
                 
+        except asyncio.TimeoutError:
+            logging.error("❌ AI title generation timed out after %ss", TITLE_TIMEOUT_SECONDS)
         except Exception as e:
-            logging.error(f"❌ Failed to generate AI title: {e}")
+            logging.error("❌ Failed to generate AI title: %s", e)
             
         return None
     
-    def _fallback_title_generation(self, messages: list) -> Optional[str]:
-        """Fallback title generation using simple keyword extraction"""
-        all_text = " ".join(messages)
-        
-        # Simple keyword extraction
-        tech_keywords = ['python', 'discord', 'error', 'bug', 'api', 'code', 'function', '問題', 'エラー']
-        action_keywords = ['作成', 'create', '修正', 'fix', '実装', 'implement', '解決', 'solve']
-        
-        found_tech = [kw for kw in tech_keywords if kw.lower() in all_text.lower()]
-        found_action = [kw for kw in action_keywords if kw.lower() in all_text.lower()]
-        
-        if found_tech and found_action:
-            title = f"{found_action[0]} {found_tech[0]}"
-            if len(title) > 100:
-                title = title[:100]
-            return title
-        elif found_tech:
-            return f"{found_tech[0]}について"
-        elif '?' in all_text or '？' in all_text:
-            # Extract first question
-            for msg in messages[:3]:
-                if '?' in msg or '？' in msg:
-                    sentences = msg.split('。')
-                    for sentence in sentences:
-                        if '?' in sentence or '？' in sentence:
-                            clean_sentence = sentence.strip().replace('\n', ' ')
-                            if len(clean_sentence) > 100:
-                                clean_sentence = clean_sentence[:100]
-                            return clean_sentence
+    def _fallback_title_generation(self) -> Optional[str]:
+        """Fallback title generation using keyword frequencies over the recent window
         
-        return "AI Assistant Question"  # Final fallback
+        The keyword index holds the window, updated incrementally in _remember().
+        """
+        return self.keyword_index.title()
 
-    async def get_or_create_thread(self, question: str):
+    async def get_or_create_thread(self, question: str, priority: int = PRIORITY_QUESTION):
         """Get existing thread or create new one (mimics Rust OnceCell behavior)"""
-        # Try to reuse existing thread
+        await self.wait_until_ready()
+        with metrics.timer("discord_get_or_create_thread_seconds"):
+            async with self._thread_lock:
+                return await self._get_or_create_thread(question, priority)
+    
+    async def send_to_thread(self, text: str, priority: int, send) -> tuple:
+        """get_or_create_thread, then `await send(thread)`; returns (thread, is_forum, result)
+        
+        A session thread that was deleted (or closed to us) since it was
+        cached fails with NotFound / Forbidden: it is forgotten and the send
+        retried once on a newly created thread.
+        """
+        thread, is_forum = await self.get_or_create_thread(text, priority)
+        try:
+            return thread, is_forum, await send(thread)
+        except (discord.NotFound, discord.Forbidden) as e:
+            self._forget_thread(thread.id, e)  # no-op on thread_id if a concurrent call already replaced it
+        thread, is_forum = await self.get_or_create_thread(text, priority)
+        return thread, is_forum, await send(thread)
+    
+    def _forget_thread(self, thread_id: int, reason) -> None:
+        """Drop a thread Discord no longer lets us use, so the next call creates a new one"""
+        logging.warning("⚠️ Thread %s is gone (%s), starting a new one", thread_id, reason)
+        discord_objects.invalidate("channel", thread_id)
+        if self.thread_id == thread_id:
+            self.thread_id = None
+    
+    async def wait_until_ready(self) -> None:
+        """Queue behind the gateway handshake (requests can arrive before on_ready)"""
+        if discord_ready.is_set():
+            return
+        logging.info("⏳ Waiting up to %gs for Discord to be ready", self.ready_timeout)
+        try:
+            await discord_ready.wait(self.ready_timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"Discord was not ready after {self.ready_timeout:g}s")
+    
+    async def _get_or_create_thread(self, question: str, priority: int):
+        # Try to reuse existing thread (fetched if not in the gateway cache, unarchived if needed)
         if self.thread_id:
-            try:
-                thread = self.client.get_channel(self.thread_id)
-                if thread and hasattr(thread, 'archived') and not thread.archived:
-                    self._thread_reused = True
-                    return thread, self.is_forum
-            except:
-                pass
+            thread = await self._reuse_thread(priority)
+            if thread is not None:
+                self._route_thread(thread.id)
+                self._thread_reused = True
+                self._text_delivered = False
+                return thread, self.is_forum
         
-        # Create new thread (first question or thread no longer accessible)
-        channel = self.client.get_channel(self.channel_id)
+        # Create new thread (first question or thread deleted / inaccessible)
+        channel = await discord_objects.channel(self.client, self.channel_id)
         if not channel:
             raise Exception(f"Channel {self.channel_id} not found")
         
@@ -205,154 +1810,659 @@ class HumanInDiscord:
         thread_name = self.create_thread_name(question)
         
         if is_forum:
-            # フォーラムチャンネルの場合
-            thread_result = await channel.create_thread(
-                name=thread_name,
-                content=question,  # 必須パラメータ
-                auto_archive_duration=1440
+            # フォーラムチャンネルの場合（2000文字を超える本文はスレッド作成後に分割送信）
+            fits = len(question) <= DISCORD_MESSAGE_LIMIT
+            thread_result = await discord_scheduler.run(
+                priority, f"create_thread:{channel.id}",
+                functools.partial(
+                    channel.create_thread,
+                    name=thread_name,
+                    content=question if fits else thread_name,  # 必須パラメータ
+                    auto_archive_duration=1440
+                )
             )
             thread = thread_result.thread
+            self._starter_message_id = thread_result.message.id if fits else None
+            self._text_delivered = fits
         else:
             # 通常のテキストチャンネルの場合
-            thread = await channel.create_thread(
-                name=thread_name,
-                message=None,
-                auto_archive_duration=1440
+            thread = await discord_scheduler.run(
+                priority, f"create_thread:{channel.id}",
+                functools.partial(
+                    channel.create_thread,
+                    name=thread_name,
+                    message=None,
+                    auto_archive_duration=1440
+                )
             )
+            self._text_delivered = False
         
+        metrics.inc("discord_threads_created_total")
+        discord_objects.put("channel", thread)
+        self._route_thread(thread.id)
         self.thread_id = thread.id
         self.thread_title = thread_name
         self._thread_reused = False
+        self._save_state()
         return thread, is_forum
+    
+    async def _reuse_thread(self, priority: int):
+        """Resolve the session's thread, unarchiving it rather than starting a new one
+        
+        None (start a new thread) only when the thread is gone, locked or not
+        ours to use; any other error, e.g. a 5xx or a network failure, is raised
+        so a brief outage does not split the conversation.
+        """
+        thread = await discord_objects.channel(self.client, self.thread_id)  # None on NotFound / Forbidden
+        if thread is None or not hasattr(thread, 'archived'):
+            return None
+        if not thread.archived:
+            return thread
+        if getattr(thread, 'locked', False):
+            logging.info("🔒 Thread %s is locked, starting a new one", thread.id)
+            discord_objects.invalidate("channel", thread.id)
+            return None
+        try:
+            logging.info("📂 Unarchiving thread %s", thread.id)
+            unarchived = await discord_scheduler.run(priority, f"unarchive:{thread.id}",
+                                                     functools.partial(thread.edit, archived=False))
+        except (discord.NotFound, discord.Forbidden) as e:
+            logging.warning("⚠️ Could not unarchive thread %s: %s", thread.id, e)
+            discord_objects.invalidate("channel", thread.id)
+            return None
+        metrics.inc("discord_threads_unarchived_total")
+        thread = unarchived or thread
+        discord_objects.put("channel", thread)
+        return thread
+    
+    async def send_text(self, thread, text: str, priority: int) -> list:
+        """Send arbitrarily long text to a thread; returns the IDs of the messages sent
+        
+        Up to `attachment_threshold` characters the text goes out as ordered
+        chunks of at most 2000 characters; above it, as a short preview plus
+        the full payload as a file attachment (gzip-compressed when large).
+        """
+        route = f"send:{thread.id}"
+        if len(text) > self.attachment_threshold:
+            data, filename = encode_attachment(text, self.attachment_gzip_bytes)
+            preview = text[:ATTACHMENT_PREVIEW_CHARS].rstrip()
+            content = f"{preview}\n…（全文 {len(text)} 文字は添付ファイル {filename}）"
+            
+            async def send_with_file():
+                # Fresh file object per attempt; BytesIO shares `data` rather than copying it
+                return await thread.send(content, file=discord.File(io.BytesIO(data), filename=filename))
+            
+            sent = await discord_scheduler.run(priority, route, send_with_file)
+            return [sent.id]
+        
+        # Submit all chunks together so they go out back to back, in order
+        futures = [discord_scheduler.submit(priority, route, functools.partial(thread.send, chunk))
+                   for chunk in split_message(text)]
+        return [sent.id for sent in await asyncio.gather(*futures)]
 
     async def report_message(self, message: str, timeout: int = 3) -> None:
-        """Report a message to human without waiting for response"""
+        """Report a message to human without waiting for response
+        
+        The report is queued and sent in the background; `timeout` is accepted
+        for compatibility but no longer delays the caller.
+        """
+        with metrics.timer("human_report_seconds"):
+            await self._report_message(message)
+    
+    async def _report_message(self, message: str) -> None:
         try:
-            # Get user
-            user = self.client.get_user(self.user_id)
+            # Before login the user cannot be resolved: queue behind the gateway handshake first
+            await self.wait_until_ready()
+            
+            # Get user (cached; REST only on first use or after the TTL)
+            try:
+                user = await discord_objects.user(self.client, self.user_id)
+            except:
+                user = None
             if not user:
-                try:
-                    user = await self.client.fetch_user(self.user_id)
-                except:
-                    logging.error(f"Error: User {self.user_id} not found")
-                    return
+                raise RuntimeError(f"User {self.user_id} not found")
             
             # Add message to conversation history (for title updates)
-            self.conversation_history.append(message)
-            self.conversation_count += 1
-            
-            # Get or create persistent thread (reuse existing logic)
-            thread, is_forum = await self.get_or_create_thread(message)
-            
-            # Send message to Discord
-            if hasattr(self, '_thread_reused') and self._thread_reused:
-                await thread.send(f"{message}")
-            elif not is_forum:
-                await thread.send(f"{message}")
-            
-            # Wait for specified timeout (do not wait for response)
-            await asyncio.sleep(timeout)
+            self._remember(message)
             
             # Check if we should update the title
             if self.conversation_count == 6 or (self.conversation_count > 6 and self.conversation_count % 10 == 0):
-                await self.update_thread_title_if_needed(thread)
+                self._title_due = True
             
-            logging.info(f"🔔 Message reported and timeout completed")
+            self.reports.put(message)
+            logging.info("🔔 Message queued (queue depth %d)", self.reports.depth)
             
         except Exception as e:
-            logging.error(f"❌ Error in report_message: {e}")
+            logging.error("❌ Error in report_message: %s", e)
             raise
     
-    async def ask(self, question: str) -> str:
-        """Ask a question to human via Discord and wait for response"""
+    async def _send_report(self, text: str) -> None:
+        """ReportQueue sender: deliver one merged batch of reports"""
+        async def send(thread):
+            # Send message to Discord (unless it already went out as the forum starter message)
+            if not self._text_delivered:
+                await self.send_text(thread, text, PRIORITY_REPORT)
+        
+        # Get or create persistent thread (reuse existing logic)
+        thread, is_forum, _ = await self.send_to_thread(text, PRIORITY_REPORT, send)
+        log_thread_id.set(thread.id)
+        
+        if self._title_due:
+            self._title_due = False
+            self.title_worker.schedule(thread)
+    
+    async def ask(self, question: str, timeout: float = ASK_TIMEOUT_SECONDS) -> str:
+        """Ask a question to human via Discord and wait up to `timeout` seconds for the response"""
+        with metrics.timer("human_ask_seconds"):
+            return await self._ask(question, timeout)
+    
+    async def _ask(self, question: str, timeout: float) -> str:
         try:
-            # Get user
-            user = self.client.get_user(self.user_id)
+            # Before login the user cannot be resolved: queue behind the gateway handshake first
+            await self.wait_until_ready()
+            
+            # Get user (cached; REST only on first use or after the TTL)
+            try:
+                user = await discord_objects.user(self.client, self.user_id)
+            except:
+                user = None
             if not user:
-                try:
-                    user = await self.client.fetch_user(self.user_id)
-                except:
-                    return f"Error: User {self.user_id} not found"
+                return f"Error: User {self.user_id} not found"
             
             # Add question to conversation history
-            self.conversation_history.append(question)
-            self.conversation_count += 1
+            self._remember(question)
             
-            # Get or create persistent thread
-            thread, is_forum = await self.get_or_create_thread(question)
+            # Reports queued before this question should still appear above it
+            await self.reports.flush()
             
-            # 既存スレッドを再利用している場合は、新しい質問を送信
-            if hasattr(self, '_thread_reused') and self._thread_reused:
-                await thread.send(f"{question}")
-            # フォーラムチャンネルでない場合は、質問メッセージを送信
-            # （フォーラムの場合は作成時に既に送信済み）
-            elif not is_forum:
-                await thread.send(f"{question}")
+            # Asked before a restart: wait on the re-attached question instead of posting it again
+            restored = self._restored_questions.pop(question, None)
+            if restored:
+                return await self._await_restored(question, *restored)
             
-            # Wait for response
-            future = asyncio.Future()
-            pending_questions[thread.id] = future
+            # Post it to the persistent thread and register for the answer
+            thread, future, message_id = await self._post_question(question)
             
             try:
-                response = await asyncio.wait_for(future, timeout=21600)
+                # Wait for response; the shared deadline heap expires it and sends the reminders
+                asked = time.perf_counter()
+                question_deadlines.add(future, timeout, remind=functools.partial(
+                    self._remind, thread.id, message_id, time.monotonic(), future=future))
+                release_tool_call_slot()
+                response = await future
+                metrics.observe("human_response_seconds", time.perf_counter() - asked)
+                if self.store and message_id:
+                    self.store.remove_question(message_id)  # answered: nothing to re-attach on restart
                 
                 # Add response to conversation history
-                self.conversation_history.append(response)
-                self.conversation_count += 1
-                
-                # Check if we should update the title (after 3 exchanges = 6 messages)
-                if self.conversation_count == 6 or (self.conversation_count > 6 and self.conversation_count % 10 == 0):  # Check at 6, then every 10 messages
-                    await self.update_thread_title_if_needed(thread)
+                self._remember(response)
+                self._schedule_title_if_due(thread)
                 
                 return response
             except asyncio.TimeoutError:
-                pending_questions.pop(thread.id, None)
-                return "No response received within 6 hours"
+                metrics.inc("human_ask_timeouts_total")
+                if self.store and message_id:
+                    self.store.remove_question(message_id)
+                return f"No response received within {describe_duration(timeout)}"
+            except asyncio.CancelledError:
+                # Abandoned by the client: nothing should wait for it after a restart.
+                # A question cancelled by shutdown stays in the store and is re-attached on restart.
+                if self.store and message_id and cancelled_by_client():
+                    self.store.remove_question(message_id)
+                raise
+            finally:
+                pending_questions.discard(thread.id, future)
                 
         except Exception as e:
             return f"Error: {str(e)}"
     
+    async def _post_question(self, question: str) -> tuple:
+        """Send a question to the session thread; returns (thread, answer future, last message id)"""
+        future = asyncio.get_event_loop().create_future()
+        
+        async def send(thread) -> list:
+            # Register before sending so an instant reply cannot slip past us
+            pending_questions.add(thread.id, future)
+            try:
+                # 既存スレッドを再利用している場合、またはフォーラムチャンネルでない場合は、質問メッセージを送信
+                # （新規フォーラムスレッドの場合は作成時に既に送信済み）
+                if not self._text_delivered:
+                    return await self.send_text(thread, question, PRIORITY_QUESTION)
+                return [self._starter_message_id]
+            except BaseException:
+                pending_questions.discard(thread.id, future)
+                raise
+        
+        # Get or create persistent thread
+        thread, is_forum, message_ids = await self.send_to_thread(question, PRIORITY_QUESTION, send)
+        log_thread_id.set(thread.id)
+        
+        # A reply to any chunk of the question answers it
+        for chunk_id in message_ids:
+            pending_questions.link_message(thread.id, future, chunk_id)
+        message_id = message_ids[-1] if message_ids else None
+        if self.store and message_id:
+            self.store.add_question(message_id, thread.id, question)
+        return thread, future, message_id
+    
+    def _schedule_title_if_due(self, thread) -> None:
+        # Check if we should update the title (after 3 exchanges = 6 messages)
+        if self.conversation_count == 6 or (self.conversation_count > 6 and self.conversation_count % 10 == 0):  # Check at 6, then every 10 messages
+            self.title_worker.schedule(thread)  # runs in the background
+    
+    async def ask_many(self, questions: list, timeout: float = ASK_TIMEOUT_SECONDS) -> list:
+        """Post several questions at once and wait for their answers in parallel
+        
+        Each question is its own numbered message, so a reply to it answers
+        exactly that question (plain messages answer the oldest open one).
+        Every question waits up to `timeout` seconds on its own; returns one
+        {"question", "answer", "status"} per question, unanswered ones included.
+        """
+        with metrics.timer("human_ask_many_seconds"):
+            return await self._ask_many(questions, timeout)
+    
+    async def _ask_many(self, questions: list, timeout: float) -> list:
+        await self.wait_until_ready()
+        user = None
+        try:
+            user = await discord_objects.user(self.client, self.user_id)
+        except Exception:
+            pass
+        if not user:
+            raise RuntimeError(f"User {self.user_id} not found")
+        
+        total = len(questions)
+        header = f"❓ {total} 件の質問があります（各質問に返信して回答してください）"
+        for question in questions:
+            self._remember(question)
+        await self.reports.flush()
+        
+        loop = asyncio.get_event_loop()
+        futures = [loop.create_future() for _ in questions]
+        message_ids = [None] * total
+        batch = None
+        
+        async def send_all(thread) -> list:
+            for future in futures:
+                pending_questions.add(thread.id, future)
+            try:
+                # Header (unless it is the new forum thread's starter) and numbered questions, submitted together
+                sends = [] if self._text_delivered else [self.send_text(thread, header, PRIORITY_QUESTION)]
+                sends += [self.send_text(thread, f"**[{i + 1}/{total}]** {question}", PRIORITY_QUESTION)
+                          for i, question in enumerate(questions)]
+                return await asyncio.gather(*sends)
+            except BaseException:
+                for future in futures:
+                    pending_questions.discard(thread.id, future)
+                raise
+        
+        thread, is_forum, sent = await self.send_to_thread(header, PRIORITY_QUESTION, send_all)
+        log_thread_id.set(thread.id)
+        
+        async def wait_one(index: int) -> dict:
+            result = {"question": questions[index], "answer": None, "status": "timeout"}
+            try:
+                result["answer"] = await futures[index]
+                result["status"] = "answered"
+                metrics.observe("human_response_seconds", time.perf_counter() - asked)
+            except asyncio.TimeoutError:
+                metrics.inc("human_ask_timeouts_total")
+            if self.store and message_ids[index]:
+                self.store.remove_question(message_ids[index])
+            return result
+        
+        try:
+            for index, chunk_ids in enumerate(sent[-total:]):
+                for chunk_id in chunk_ids:
+                    pending_questions.link_message(thread.id, futures[index], chunk_id)
+                message_ids[index] = chunk_ids[-1] if chunk_ids else None
+                if self.store and message_ids[index]:
+                    self.store.add_question(message_ids[index], thread.id, questions[index])
+            
+            asked = time.perf_counter()
+            for future in futures:
+                question_deadlines.add(future, timeout)
+            # One reminder per batch, replying to the first question, rather than one per question
+            batch = loop.create_future()
+            started = time.monotonic()
+            
+            async def remind(level: int) -> None:
+                left = sum(not future.done() for future in futures)
+                await self._remind(thread.id, message_ids[0], started, level, note=f"（未回答 {left}/{total} 件）")
+            
+            question_deadlines.add(batch, timeout, on_expire=batch.cancel, remind=remind)
+            release_tool_call_slot()
+            results = await asyncio.gather(*(wait_one(i) for i in range(total)))
+        finally:
+            for future in futures:
+                pending_questions.discard(thread.id, future)
+            if batch is not None and not batch.done():
+                batch.cancel()
+        
+        for result in results:
+            if result["answer"] is not None:
+                self._remember(result["answer"])
+        self._schedule_title_if_due(thread)
+        return results
+    
+    async def ask_async(self, question: str, timeout: float = ASK_TIMEOUT_SECONDS) -> str:
+        """Post a question and return a ticket id at once; the answer is kept until collected"""
+        if self.tickets.full():
+            raise RuntimeError(f"Too many uncollected tickets ({self.tickets.max_open}); collect some answers first")
+        await self.wait_until_ready()
+        user = None
+        try:
+            user = await discord_objects.user(self.client, self.user_id)
+        except Exception:
+            pass
+        if not user:
+            raise RuntimeError(f"User {self.user_id} not found")
+        
+        self._remember(question)
+        await self.reports.flush()
+        thread, future, message_id = await self._post_question(question)
+        ticket_id = str(message_id) if message_id else f"t{id(future)}"
+        if self.store and message_id:
+            future.add_done_callback(lambda f, m=message_id: self._persist_answer(m, f))
+        self.tickets.add(ticket_id, question, future, thread.id, message_id, time.time() + timeout, thread)
+        question_deadlines.add(future, timeout, on_expire=functools.partial(self._expire_ticket, ticket_id, future),
+                               remind=functools.partial(self._remind, thread.id, message_id, time.monotonic(),
+                                                        future=future))
+        metrics.inc("human_tickets_total")
+        return ticket_id
+    
+    def _expire_ticket(self, ticket_id: str, future: asyncio.Future) -> None:
+        """Stop listening for an unanswered ticket; it reports "expired" until collected"""
+        ticket = self.tickets.get(ticket_id)
+        if ticket is None or ticket[1] is not future or future.done():
+            return
+        pending_questions.discard(ticket[2], future)
+        future.cancel()
+        metrics.inc("human_ask_timeouts_total")
+        if self.store and ticket[3]:
+            self.store.remove_question(ticket[3])
+    
+    def check_ticket(self, ticket_id: str) -> Dict[str, Any]:
+        """Status of a ticket; an answered or expired ticket is collected (forgotten) by this call"""
+        ticket = self.tickets.get(ticket_id)
+        if ticket is None:
+            return {"ticket": ticket_id, "status": "unknown"}
+        question, future, thread_id, message_id, deadline, thread = ticket
+        if not future.done() and time.time() >= deadline:
+            self._expire_ticket(ticket_id, future)
+        if not future.done():
+            return {"ticket": ticket_id, "status": "pending", "question": question}
+        
+        self.tickets.pop(ticket_id)
+        if self._restored_questions.get(question, (None, None, None))[2] is future:
+            del self._restored_questions[question]
+        if future.cancelled():
+            return {"ticket": ticket_id, "status": "expired", "question": question}
+        answer = future.result()
+        if self.store and message_id:
+            self.store.remove_question(message_id)
+        self._remember(answer)
+        if thread is not None:
+            self._schedule_title_if_due(thread)
+        return {"ticket": ticket_id, "status": "answered", "question": question, "answer": answer}
+    
+    async def wait_ticket(self, ticket_id: str, timeout: float = TICKET_WAIT_DEFAULT_SECONDS) -> Dict[str, Any]:
+        """Long-poll: wait up to `timeout` seconds (capped) for the answer, then check_ticket()"""
+        ticket = self.tickets.get(ticket_id)
+        if ticket is not None and not ticket[1].done():
+            timeout = min(timeout, TICKET_WAIT_MAX_SECONDS, max(0.0, ticket[4] - time.time()))
+            release_tool_call_slot()
+            try:
+                # shield: a finished long-poll must not cancel the question itself
+                await asyncio.wait_for(asyncio.shield(ticket[1]), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                if not ticket[1].cancelled():
+                    raise  # the long-poll itself was cancelled, not the ticket expired
+        return self.check_ticket(ticket_id)
+    
+    async def _await_restored(self, question: str, thread_id: int, message_id: int, future: asyncio.Future,
+                              deadline: float) -> str:
+        logging.info("♻️ Re-attached to question %s asked before restart", message_id)
+        pending_questions.accept_plain(future)  # an agent waits on it again
+        release_tool_call_slot()
+        try:
+            # shield: the question outlives this call; restore() registered its deadline
+            response = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if future.cancelled():
+                self.tickets.pop(str(message_id))
+                return f"No response received within {describe_duration(ASK_TIMEOUT_SECONDS)}"
+            if cancelled_by_client():
+                # Abandoned: stop listening and drop it from the store
+                pending_questions.discard(thread_id, future)
+                future.cancel()
+                self.tickets.pop(str(message_id))
+                if self.store:
+                    self.store.remove_question(message_id)
+                raise
+            # Keep it re-attachable for the next identical ask
+            self._restored_questions.setdefault(question, (thread_id, message_id, future, deadline))
+            raise
+        
+        if self.store:
+            self.store.remove_question(message_id)
+        self.tickets.pop(str(message_id))
+        self._remember(response)
+        return response
+    
     async def update_thread_title_if_needed(self, thread):
         """Update thread title based on conversation analysis"""
         try:
             new_title = await self.analyze_conversation_for_title()
             if new_title and new_title != self.thread_title:
-                logging.info(f"🏷️ Updating thread title: '{self.thread_title}' -> '{new_title}'")
-                await thread.edit(name=new_title)
+                logging.info("🏷️ Updating thread title: '%s' -> '%s'", self.thread_title, new_title)
+                await discord_scheduler.run(PRIORITY_TITLE, f"edit:{thread.id}",
+                                            functools.partial(thread.edit, name=new_title), stale_key=thread.id)
                 self.thread_title = new_title
-                logging.info(f"✅ Thread title updated successfully")
+                self._save_state()
+                logging.info("✅ Thread title updated successfully")
+        except JobDropped as e:
+            logging.info("🏷️ Skipped title update: %s", e)
+        except (discord.NotFound, discord.Forbidden) as e:
+            self._forget_thread(thread.id, e)
         except Exception as e:
-            logging.error(f"❌ Failed to update thread title: {e}")
+            logging.error("❌ Failed to update thread title: %s", e)
 
 class HumanInTheLoopBot(commands.Bot):
     """Discord bot for human-in-the-loop interactions"""
     
-    def __init__(self, channel_id: int, user_id: int):
-        intents = discord.Intents.default()
+    def __init__(self, lean: bool = False):
+        if lean:
+            # Only what on_message needs: threads (guilds) and their messages with content.
+            # No message cache, no member cache, no chunking; lookups fall back to REST.
+            intents = discord.Intents.none()
+            options = dict(max_messages=None, member_cache_flags=discord.MemberCacheFlags.none(),
+                           chunk_guilds_at_startup=False)
+        else:
+            intents = discord.Intents.default()
+            options = {}
         intents.message_content = True
         intents.guilds = True
         intents.guild_messages = True
         
-        super().__init__(command_prefix='!', intents=intents)
-        self.target_channel_id = channel_id
-        self.target_user_id = user_id
+        super().__init__(command_prefix='!', intents=intents, **options)
+        self._recovery: Optional[asyncio.Task] = None
         
     async def on_ready(self):
-        logging.info(f'Discord bot ready! Logged in as {self.user}')
+        logging.info('Discord bot ready! Logged in as %s', self.user)
+        mark_startup("discord_ready")
+        if discord_ready.is_set():
+            # READY again means a fresh session: nothing missed while disconnected is replayed
+            self._start_recovery("ready")
+        elif pending_questions.by_thread:
+            # Questions re-attached by restore(): read what was answered while the process was down
+            self._start_recovery("startup")
+        discord_ready.set()
+    
+    async def on_resumed(self):
+        logging.info('🔌 Discord gateway session resumed')
+        self._start_recovery("resumed")
         
     async def on_message(self, message):
-        if message.author == self.user:
-            return
-            
-        if (isinstance(message.channel, discord.Thread) and 
-            message.channel.parent_id == self.target_channel_id and 
-            message.author.id == self.target_user_id):
-            
-            thread_id = message.channel.id
-            if thread_id in pending_questions:
-                future = pending_questions.pop(thread_id)
-                if not future.done():
-                    future.set_result(message.content)
+        route_message(message)
+    
+    def _start_recovery(self, reason: str) -> None:
+        if self._recovery is not None and not self._recovery.done():
+            return  # one scan at a time; it reads up to the newest message anyway
+        self._recovery = asyncio.create_task(recover_missed_answers(self, reason))
+
+def route_message(message) -> bool:
+    """Hand a thread message to the question waiting for it; True if it answered one"""
+    # One dict lookup rejects everything outside our sessions' threads (any parent channel);
+    # works for uncached threads (--lean) too, since only the channel id is used
+    route = thread_routes.get(message.channel.id)
+    if route is None or not thread_routes.seen(message.channel.id, message.id):
+        return False
+    if message.author.id not in route[1]:
+        return False
+    
+    # Replies go to the question they reference, plain messages to the oldest one
+    reply_to = message.reference.message_id if message.reference else None
+    return pending_questions.resolve(message.channel.id, message.content, reply_to)
+
+async def recover_missed_answers(client, reason: str) -> int:
+    """Replay answers posted while the gateway was down
+    
+    Only threads with unanswered questions are read, each from the last
+    message seen there (or its oldest question), a page at a time and at most
+    RECOVERY_MAX_MESSAGES per thread, so the cost follows the gap length.
+    """
+    started = time.perf_counter()
+    recovered = scanned = 0
+    for thread_id in list(pending_questions.by_thread):
+        if thread_id not in thread_routes.routes:
+            continue
+        log_thread_id.set(thread_id)
+        after = thread_routes.last_seen.get(thread_id)
+        if after is None:
+            # Nothing seen live yet (e.g. restored questions): answers follow the question messages
+            linked = [mid for mids in pending_questions.by_thread.get(thread_id, {}).values() for mid in mids]
+            if not linked:
+                continue
+            after = min(linked)
+        
+        try:
+            thread = await discord_objects.channel(client, thread_id)
+            budget = RECOVERY_MAX_MESSAGES
+            while thread is not None and budget > 0 and thread_id in pending_questions:
+                limit = min(RECOVERY_PAGE_SIZE, budget)
+                page = [message async for message in
+                        thread.history(limit=limit, after=discord.Object(id=after), oldest_first=True)]
+                for message in page:
+                    after = max(after, message.id)
+                    if route_message(message):
+                        recovered += 1
+                scanned += len(page)
+                budget -= len(page)
+                if len(page) < limit:
+                    break
+            if budget <= 0 and thread_id in pending_questions:
+                logging.warning("⚠️ Recovery stopped after %s messages in thread %s",
+                                RECOVERY_MAX_MESSAGES, thread_id)
+        except discord.HTTPException as e:
+            logging.warning("⚠️ Could not read history of thread %s: %s", thread_id, e)
+    
+    metrics.inc("gateway_recoveries_total", reason=reason)
+    metrics.inc("recovery_messages_scanned_total", scanned)
+    metrics.inc("recovery_answers_total", recovered)
+    metrics.observe("recovery_seconds", time.perf_counter() - started)
+    if scanned:
+        logging.info("🔁 Recovery after %s: %s messages read, %s answers replayed", reason, scanned, recovered)
+    return recovered
+
+# Static MCP results, built once at import so initialize / tools/list need no Discord or per-request work
+INITIALIZE_RESULT = {
+    "protocolVersion": "2024-11-05",
+    "capabilities": {"tools": {"listChanged": True}},
+    "serverInfo": {"name": "human-in-the-loop", "version": "1.0.0"}
+}
+
+TOOLS_LIST_RESULT = {
+    "tools": [{
+        "name": "ask_human",
+        "description": "Ask a human for information that only they would know",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "question": {"type": "string", "description": "The question to ask the human"},
+                "timeout": {"type": "number", "description": "Seconds to wait for the answer (default 6 hours)"}
+            },
+            "required": ["question"]
+        }
+    }, {
+        "name": "report_to_human",
+        "description": "Report a message to human without waiting for response",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "message": {"type": "string", "description": "Message to report"},
+                "timeout": {"type": "number", "description": "Deprecated, ignored: reports are queued and return immediately"}
+            },
+            "required": ["message"]
+        }
+    }, {
+        "name": "ask_human_many",
+        "description": "Ask a human several questions at once and collect the answers in parallel; "
+                       "questions left unanswered within the timeout are returned with status \"timeout\"",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "questions": {"type": "array", "items": {"type": "string"}, "minItems": 1,
+                              "maxItems": ASK_MANY_MAX_QUESTIONS, "description": "The questions to ask the human"},
+                "timeout": {"type": "number", "description": "Seconds to wait for each answer (default 6 hours)"}
+            },
+            "required": ["questions"]
+        }
+    }, {
+        "name": "ask_human_async",
+        "description": "Post a question to a human and return a ticket immediately; "
+                       "collect the answer later with check_human_response or wait_human_response",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "question": {"type": "string", "description": "The question to ask the human"},
+                "timeout": {"type": "number", "description": "Seconds the question stays open (default 6 hours)"}
+            },
+            "required": ["question"]
+        }
+    }, {
+        "name": "check_human_response",
+        "description": "Return the status of an ask_human_async ticket without waiting "
+                       "(pending, answered, expired or unknown); answered tickets are collected. "
+                       "Without a ticket, checks every open ticket",
+        "inputSchema": {
+            "type": "object",
+            "properties": {"ticket": {"type": "string", "description": "Ticket returned by ask_human_async"}}
+        }
+    }, {
+        "name": "wait_human_response",
+        "description": "Wait a bounded time for the answer to an ask_human_async ticket, then return its status",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "ticket": {"type": "string", "description": "Ticket returned by ask_human_async"},
+                "timeout": {"type": "number", "description": f"Seconds to wait (default {TICKET_WAIT_DEFAULT_SECONDS:g}, "
+                                                             f"at most {TICKET_WAIT_MAX_SECONDS:g})"}
+            },
+            "required": ["ticket"]
+        }
+    }, {
+        "name": "stats",
+        "description": "Latency histograms and counters for tool calls, Discord API calls and human response time",
+        "inputSchema": {"type": "object", "properties": {}}
+    }]
+}
+
+def is_positive_number(value) -> bool:
+    """A JSON number > 0 (`true` is not a timeout of 1 second)"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
 
 class MCPHandler:
     """MCP request handler"""
@@ -361,52 +2471,38 @@ class MCPHandler:
         self.human_handler = human_handler
     
     async def handle_request(self, request):
-        """Handle MCP requests"""
+        """Handle MCP requests (timed per method and tool)"""
+        method = request.get("method")
+        tool = (request.get("params") or {}).get("name") if method == "tools/call" else None
+        log_thread_id.set(self.human_handler.thread_id)  # the session's thread, until a call resolves another
+        started = time.perf_counter()
+        try:
+            response = await self._handle_request(request)
+        except asyncio.CancelledError:
+            metrics.inc("mcp_requests_total", method=method, tool=tool, outcome="cancelled")
+            raise
+        finally:
+            metrics.observe("mcp_request_seconds", time.perf_counter() - started, method=method, tool=tool)
+        outcome = "error" if response and "error" in response else "ok"
+        metrics.inc("mcp_requests_total", method=method, tool=tool, outcome=outcome)
+        return response
+    
+    async def _handle_request(self, request):
         method = request.get("method")
         params = request.get("params", {})
         request_id = request.get("id")
         
         if method == "initialize":
-            return {
-                "jsonrpc": "2.0",
-                "id": request_id,
-                "result": {
-                    "protocolVersion": "2024-11-05",
-                    "capabilities": {"tools": {"listChanged": True}},
-                    "serverInfo": {"name": "human-in-the-loop", "version": "1.0.0"}
-                }
-            }
+            return {"jsonrpc": "2.0", "id": request_id, "result": INITIALIZE_RESULT}
         
         elif method == "notifications/initialized":
             return None
         
+        elif method == "ping":
+            return {"jsonrpc": "2.0", "id": request_id, "result": {}}
+        
         elif method == "tools/list":
-            return {
-                "jsonrpc": "2.0",
-                "id": request_id,
-                "result": {
-                    "tools": [{
-                        "name": "ask_human",
-                        "description": "Ask a human for information that only they would know",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {"question": {"type": "string", "description": "The question to ask the human"}},
-                            "required": ["question"]
-                        }
-                    }, {
-                        "name": "report_to_human",
-                        "description": "Report a message to human without waiting for response",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "message": {"type": "string", "description": "Message to report"},
-                                "timeout": {"type": "number", "description": "Timeout in seconds (default: 3)"}
-                            },
-                            "required": ["message"]
-                        }
-                    }]
-                }
-            }
+            return {"jsonrpc": "2.0", "id": request_id, "result": TOOLS_LIST_RESULT}
         
         elif method == "tools/call":
             tool_name = params.get("name")
@@ -414,11 +2510,18 @@ class MCPHandler:
             
             if tool_name == "ask_human":
                 question = arguments.get("question", "")
-                logging.info(f"🔧 ask_human called with: {question[:50]}...")
+                timeout = arguments.get("timeout", ASK_TIMEOUT_SECONDS)
+                if not is_positive_number(timeout):
+                    return {
+                        "jsonrpc": "2.0",
+                        "id": request_id,
+                        "error": {"code": -32602, "message": "Invalid params: 'timeout' must be a positive number"}
+                    }
+                logging.info("🔧 ask_human called with: %.50s...", question)
                 
                 try:
-                    response_text = await self.human_handler.ask(question)
-                    logging.info(f"✅ Got response: {response_text[:50]}...")
+                    response_text = await self.human_handler.ask(question, timeout)
+                    logging.info("✅ Got response: %.50s...", response_text)
                     
                     return {
                         "jsonrpc": "2.0",
@@ -428,7 +2531,79 @@ class MCPHandler:
                         }
                     }
                 except Exception as e:
-                    logging.error(f"❌ Error in ask_human: {e}")
+                    logging.error("❌ Error in ask_human: %s", e)
+                    return {
+                        "jsonrpc": "2.0",
+                        "id": request_id,
+                        "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
+                    }
+            
+            elif tool_name == "ask_human_many":
+                questions = arguments.get("questions")
+                timeout = arguments.get("timeout", ASK_TIMEOUT_SECONDS)
+                if (not isinstance(questions, list) or not questions or len(questions) > ASK_MANY_MAX_QUESTIONS
+                        or not all(isinstance(q, str) and q.strip() for q in questions)
+                        or not is_positive_number(timeout)):
+                    return {
+                        "jsonrpc": "2.0",
+                        "id": request_id,
+                        "error": {"code": -32602, "message": f"Invalid params: 'questions' must be 1-{ASK_MANY_MAX_QUESTIONS} "
+                                                             "non-empty strings and 'timeout' a positive number"}
+                    }
+                logging.info("🔧 ask_human_many called with %d questions", len(questions))
+                
+                try:
+                    results = await self.human_handler.ask_many(questions, timeout)
+                    answered = sum(1 for r in results if r["status"] == "answered")
+                    logging.info("✅ Got %d/%d answers", answered, len(results))
+                    
+                    return {
+                        "jsonrpc": "2.0",
+                        "id": request_id,
+                        "result": {
+                            "content": [{"type": "text", "text": json.dumps({"answers": results}, ensure_ascii=False)}]
+                        }
+                    }
+                except Exception as e:
+                    logging.error("❌ Error in ask_human_many: %s", e)
+                    return {
+                        "jsonrpc": "2.0",
+                        "id": request_id,
+                        "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
+                    }
+            
+            elif tool_name in ("ask_human_async", "check_human_response", "wait_human_response"):
+                default_timeout = ASK_TIMEOUT_SECONDS if tool_name == "ask_human_async" else TICKET_WAIT_DEFAULT_SECONDS
+                timeout = arguments.get("timeout", default_timeout)
+                if tool_name != "check_human_response" and not is_positive_number(timeout):
+                    return {
+                        "jsonrpc": "2.0",
+                        "id": request_id,
+                        "error": {"code": -32602, "message": "Invalid params: 'timeout' must be a positive number"}
+                    }
+                try:
+                    if tool_name == "ask_human_async":
+                        question = arguments.get("question", "")
+                        logging.info("🔧 ask_human_async called with: %.50s...", question)
+                        ticket = await self.human_handler.ask_async(question, float(timeout))
+                        result = {"ticket": ticket, "status": "pending"}
+                    elif tool_name == "check_human_response":
+                        if arguments.get("ticket"):
+                            result = self.human_handler.check_ticket(str(arguments["ticket"]))
+                        else:
+                            result = {"tickets": [self.human_handler.check_ticket(t) for t in self.human_handler.tickets]}
+                    else:
+                        result = await self.human_handler.wait_ticket(str(arguments.get("ticket", "")), float(timeout))
+                    
+                    return {
+                        "jsonrpc": "2.0",
+                        "id": request_id,
+                        "result": {
+                            "content": [{"type": "text", "text": json.dumps(result, ensure_ascii=False)}]
+                        }
+                    }
+                except Exception as e:
+                    logging.error("❌ Error in %s: %s", tool_name, e)
                     return {
                         "jsonrpc": "2.0",
                         "id": request_id,
@@ -438,11 +2613,11 @@ class MCPHandler:
             elif tool_name == "report_to_human":
                 message = arguments.get("message", "")
                 timeout = arguments.get("timeout", 3)
-                logging.info(f"🔧 report_to_human called with: {message[:50]}...")
+                logging.info("🔧 report_to_human called with: %.50s...", message)
                 
                 try:
                     await self.human_handler.report_message(message, timeout)
-                    logging.info(f"✅ Message reported successfully")
+                    logging.info("✅ Message reported successfully")
                     
                     return {
                         "jsonrpc": "2.0",
@@ -452,29 +2627,354 @@ class MCPHandler:
                         }
                     }
                 except Exception as e:
-                    logging.error(f"❌ Error in report_to_human: {e}")
+                    logging.error("❌ Error in report_to_human: %s", e)
                     return {
                         "jsonrpc": "2.0",
                         "id": request_id,
                         "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
                     }
         
+            elif tool_name == "stats":
+                snapshot = metrics.snapshot()
+                snapshot["discord_scheduler"] = discord_scheduler.stats()
+                snapshot["report_queue"] = self.human_handler.reports.stats()
+                snapshot["question_deadlines"] = question_deadlines.stats()
+                return {
+                    "jsonrpc": "2.0",
+                    "id": request_id,
+                    "result": {
+                        "content": [{"type": "text", "text": json.dumps(snapshot, ensure_ascii=False, indent=2)}]
+                    }
+                }
+        
         return {
             "jsonrpc": "2.0",
             "id": request_id,
             "error": {"code": -32601, "message": f"Unknown method: {method}"}
         }
 
-async def handle_stdin_input(mcp_handler):
-    """Handle stdin input asynchronously"""
-    loop = asyncio.get_event_loop()
+def json_dumps(obj) -> bytes:
+    """Compact UTF-8 JSON; orjson when installed (falls back for values it rejects, e.g. huge ints)"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def json_loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# id(result) -> encoded result, for the static results served on every connection
+_PREENCODED_RESULTS = {id(result): json_dumps(result) for result in (INITIALIZE_RESULT, TOOLS_LIST_RESULT)}
+
+def encode_message(message) -> bytes:
+    """JSON-RPC message or batch -> one newline-terminated frame
+    
+    Static results (initialize, tools/list) are spliced in from their
+    pre-encoded bytes instead of being serialized again per request.
+    """
+    if isinstance(message, list):
+        return b"[" + b",".join(encode_message(item)[:-1] for item in message) + b"]\n"
+    result = message.get("result")
+    encoded = _PREENCODED_RESULTS.get(id(result)) if result is not None else None
+    if encoded is not None and len(message) == 3:
+        return b'{"jsonrpc":"2.0","id":' + json_dumps(message.get("id")) + b',"result":' + encoded + b"}\n"
+    return json_dumps(message) + b"\n"
+
+class FrameTooLarge(Exception):
+    """read_frame() skipped a frame over max_frame_bytes; the reader is positioned after it"""
+    
+    def error_response(self) -> Dict[str, Any]:
+        """What the client gets instead: the request id is unknown, so id is null"""
+        return {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": f"Invalid Request: {self}"}}
+
+class StdioTransport:
+    """Newline-delimited JSON-RPC over stdin/stdout using asyncio streams
+    
+    Lines larger than the StreamReader limit are assembled chunk by chunk, and
+    responses finishing in the same loop iteration are written with a single
+    drain so the pipe is flushed once per burst instead of once per message.
+    Falls back to thread-pool I/O when stdin/stdout are not pipes (e.g. a file).
+    """
+    
+    def __init__(self, stdin=None, stdout=None, limit: int = STDIO_READ_LIMIT, max_frame_bytes: int = MAX_FRAME_BYTES):
+        self.stdin = stdin if stdin is not None else sys.stdin
+        self.stdout = stdout if stdout is not None else sys.stdout
+        self.limit = limit
+        self.max_frame_bytes = max_frame_bytes
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self._pending = []  # encoded frames not yet written
+        self._pending_waiters = []  # futures resolved once their frame is flushed
+        self._wakeup = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+        self._unread = []  # frames handed back with pushback()
+    
+    @classmethod
+    def from_streams(cls, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                     max_frame_bytes: int = MAX_FRAME_BYTES) -> "StdioTransport":
+        """Same framing over an already-open stream pair (daemon socket connections)"""
+        transport = cls(max_frame_bytes=max_frame_bytes)
+        transport.reader = reader
+        transport.writer = writer
+        return transport
+    
+    async def connect(self) -> None:
+        if self.reader is not None:  # from_streams()
+            self._writer_task = asyncio.ensure_future(self._write_loop())
+            return
+        loop = asyncio.get_event_loop()
+        try:
+            reader = asyncio.StreamReader(limit=self.limit)
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), self.stdin)
+            transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, self.stdout)
+            self.reader = reader
+            self.writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        except (ValueError, OSError, NotImplementedError) as e:
+            logging.warning("⚠️ stdio is not a pipe (%s), using thread-pool I/O", e)
+            self.reader = None
+            self.writer = None
+        self._writer_task = asyncio.ensure_future(self._write_loop())
+    
+    async def read_frame(self) -> Optional[bytes]:
+        """Read one newline-terminated frame; returns None on EOF, raises FrameTooLarge for oversized ones"""
+        if self._unread:
+            return self._unread.pop()
+        if self.reader is None:
+            line = await asyncio.get_event_loop().run_in_executor(None, self._stdin_buffer().readline)
+            return line or None
+        
+        chunks = []
+        size = 0
+        while True:
+            try:
+                chunk = await self.reader.readuntil(b"\n")
+                done = True
+            except asyncio.LimitOverrunError as e:
+                # Frame is bigger than the buffer: take what we have and keep reading
+                chunk = await self.reader.readexactly(e.consumed)
+                done = False
+            except asyncio.IncompleteReadError as e:
+                # EOF; hand out a final unterminated frame if there is one
+                chunk = e.partial
+                done = True
+                if not chunk and not chunks:
+                    return None
+            
+            size += len(chunk)
+            if size > self.max_frame_bytes:
+                if size - len(chunk) <= self.max_frame_bytes:
+                    logging.error("❌ Dropping frame larger than %s bytes", self.max_frame_bytes)
+                    chunks = []
+                if done:
+                    raise FrameTooLarge(f"frame larger than {self.max_frame_bytes} bytes")
+                continue
+            chunks.append(chunk)
+            if done:
+                return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+    
+    def pushback(self, frame: bytes) -> None:
+        """Return a frame so the next read_frame() yields it again"""
+        self._unread.append(frame)
+    
+    async def send(self, message) -> None:
+        """Queue a JSON-RPC message (or batch) and wait until it has been flushed to stdout"""
+        await self.send_frame(encode_message(message))
+    
+    async def send_frame(self, frame: bytes) -> None:
+        """Queue an already-encoded frame (must end with a newline) and wait until it is flushed"""
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append(frame)
+        self._pending_waiters.append(future)
+        self._wakeup.set()
+        await future
+    
+    def write_eof(self) -> None:
+        """Half-close: the peer sees EOF while responses can still be read"""
+        if self.writer is not None and self.writer.can_write_eof():
+            self.writer.write_eof()
+    
+    async def close(self) -> None:
+        if self._writer_task:
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+        if self.writer is not None:
+            self.writer.close()  # lets the peer see EOF
+            self.writer = None
+    
+    async def _write_loop(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            await self._wakeup.wait()
+            # Yield once so every response completed in this iteration shares the flush
+            await asyncio.sleep(0)
+            self._wakeup.clear()
+            frames, self._pending = self._pending, []
+            waiters, self._pending_waiters = self._pending_waiters, []
+            try:
+                if self.writer is not None:
+                    self.writer.writelines(frames)
+                    await self.writer.drain()  # backpressure when the client reads slowly
+                else:
+                    await loop.run_in_executor(None, self._write_blocking, b"".join(frames))
+            except Exception as e:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                continue
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+    
+    def _stdin_buffer(self):
+        return getattr(self.stdin, "buffer", self.stdin)
+    
+    def _write_blocking(self, data: bytes) -> None:
+        out = getattr(self.stdout, "buffer", self.stdout)
+        out.write(data)
+        out.flush()
+
+class RequestDispatcher:
+    """Runs each MCP request as its own task and writes responses by id as they finish"""
+    
+    def __init__(self, mcp_handler: MCPHandler, send, max_concurrent_tool_calls: int = DEFAULT_MAX_CONCURRENT_TOOL_CALLS):
+        self.mcp_handler = mcp_handler
+        self.send = send  # coroutine function writing one JSON-RPC message
+        self.tool_call_slots = asyncio.Semaphore(max_concurrent_tool_calls)
+        self.in_flight: Dict[Any, asyncio.Task] = {}  # request id -> task
+        self.tasks = set()  # includes notifications, which have no id
+    
+    def dispatch(self, request: Dict[str, Any]) -> None:
+        """Start handling a request without waiting for it"""
+        if request.get("method") == "notifications/cancelled":
+            self.cancel(request.get("params") or {})
+            return
+        self._start(self._run(request), request.get("id"))
+    
+    def dispatch_batch(self, batch: list) -> None:
+        """JSON-RPC batch: elements run concurrently, answered together in one array"""
+        if not batch:
+            # An empty batch gets a single error object, not an array (JSON-RPC 2.0)
+            self.reply({"jsonrpc": "2.0", "id": None,
+                        "error": {"code": -32600, "message": "Invalid Request: empty batch"}})
+            return
+        tasks = []
+        errors = []
+        for request in batch:
+            if not isinstance(request, dict):
+                errors.append({"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "Invalid Request"}})
+            elif request.get("method") == "notifications/cancelled":
+                self.cancel(request.get("params") or {})
+            else:
+                tasks.append(self._start(self._respond(request), request.get("id")))
+        metrics.inc("mcp_batches_total")
+        self._start(self._run_batch(tasks, errors), None)
+    
+    def reply(self, response: Dict[str, Any]) -> None:
+        """Send a response that needs no handling (errors about the frame itself)"""
+        self._start(self._send_response(response), None)
+    
+    def _start(self, coro, request_id) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        if request_id is not None:
+            self.in_flight[request_id] = task
+        task.add_done_callback(lambda t: self._forget(request_id, t))
+        return task
+    
+    def cancel(self, params: Dict[str, Any]) -> None:
+        """Cancel an in-flight request (and the Discord future it waits on)"""
+        request_id = params.get("requestId")
+        task = self.in_flight.get(request_id)
+        if task and not task.done():
+            logging.info("🚫 Cancelling request %s: %s", request_id, params.get('reason', 'no reason given'))
+            client_cancelled.add(task)
+            task.cancel()
+    
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait for in-flight requests to finish and write their responses; False if `timeout` ran out first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.tasks:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            await asyncio.wait(list(self.tasks), timeout=remaining)
+        return True
+    
+    async def shutdown(self) -> None:
+        """Cancel everything still running (client went away)"""
+        for task in list(self.tasks):
+            task.cancel()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+    
+    def _forget(self, request_id, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        client_cancelled.discard(task)
+        if request_id is not None and self.in_flight.get(request_id) is task:
+            del self.in_flight[request_id]
+    
+    async def _respond(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Handle one request; None for notifications, failures and cancelled requests"""
+        log_request_id.set(request.get("id"))  # this task's context: tags every record it logs
+        try:
+            if request.get("method") == "tools/call":
+                # Held until the call finishes or starts waiting for the human (release_tool_call_slot)
+                await self.tool_call_slots.acquire()
+                tool_call_slot.set(self.tool_call_slots)
+                try:
+                    return await self.mcp_handler.handle_request(request)
+                finally:
+                    release_tool_call_slot()
+            return await self.mcp_handler.handle_request(request)
+        except asyncio.CancelledError:
+            # Cancelled requests get no response (MCP spec)
+            return None
+        except Exception as e:
+            logging.error("❌ Error processing request: %s", e)
+            return None
+    
+    async def _run_batch(self, tasks: list, errors: list) -> None:
+        responses = [r for r in await asyncio.gather(*tasks, return_exceptions=True) if isinstance(r, dict)]
+        await self._send_response(responses + errors if responses or errors else None)
+    
+    async def _run(self, request: Dict[str, Any]) -> None:
+        await self._send_response(await self._respond(request))
+    
+    async def _send_response(self, response) -> None:
+        if response:
+            try:
+                await self.send(response)
+            except asyncio.CancelledError:
+                return
+            except Exception as e:
+                logging.error("❌ Failed to write response: %s", e)
+                return
+            logging.debug("📤 Sent response")
+            mark_startup("first_response")
+
+async def handle_stdin_input(mcp_handler, max_concurrent_tool_calls: int = DEFAULT_MAX_CONCURRENT_TOOL_CALLS,
+                             transport: Optional[StdioTransport] = None, drain_timeout: Optional[float] = None):
+    """Handle stdin input asynchronously
+    
+    After EOF, requests still running get `drain_timeout` seconds (unbounded
+    by default, as stdio always did) to answer; the rest are cancelled.
+    """
+    if transport is None:
+        transport = StdioTransport()
+    await transport.connect()
+    mark_startup("stdio_ready")
+    dispatcher = RequestDispatcher(mcp_handler, transport.send, max_concurrent_tool_calls)
     
     while True:
         try:
-            # Read line from stdin asynchronously
-            line = await loop.run_in_executor(None, sys.stdin.readline)
+            line = await transport.read_frame()
             
-            if not line:  # EOF
+            if line is None:  # EOF
                 logging.info("📪 EOF received")
                 break
                 
@@ -482,26 +2982,233 @@ async def handle_stdin_input(mcp_handler):
             if not line:
                 continue
             
-            logging.info(f"📨 Received: {line[:100]}...")
-            request = json.loads(line)
-            response = await mcp_handler.handle_request(request)
-            
-            if response:
-                print(json.dumps(response), flush=True)
-                logging.info(f"📤 Sent response")
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug("📨 Received: %s...", line[:100].decode('utf-8', 'replace'))
+            request = json_loads(line)
+            if isinstance(request, list):
+                dispatcher.dispatch_batch(request)
+            else:
+                dispatcher.dispatch(request)
                 
+        except FrameTooLarge as e:
+            # The client would otherwise wait forever for this request's answer
+            dispatcher.reply(e.error_response())
         except json.JSONDecodeError as e:
-            logging.error(f"❌ Invalid JSON: {e}")
+            logging.error("❌ Invalid JSON: %s", e)
         except Exception as e:
-            logging.error(f"❌ Error processing request: {e}")
+            logging.error("❌ Error processing request: %s", e)
+    
+    # Like the old sequential loop, answer everything that was read before EOF
+    if not await dispatcher.drain(drain_timeout):
+        logging.info("🚫 Cancelling %d request(s) still running after EOF", len(dispatcher.tasks))
+        await dispatcher.shutdown()
+    await transport.close()
+
+async def serve_daemon(socket_path: str, new_session, max_clients: int = DAEMON_MAX_CLIENTS,
+                       max_concurrent_tool_calls: int = DEFAULT_MAX_CONCURRENT_TOOL_CALLS):
+    """Serve MCP clients on a Unix socket, one HumanInDiscord per connection
+    
+    A client may open with {"session": "<name>"} (sent by --connect) to pick
+    its session, optionally with "channel_id", "user_id" and "responder_ids"
+    to use another forum channel or responders; otherwise it gets a fresh name
+    and the daemon's defaults. All sessions share this process's Discord
+    gateway, caches and scheduler.
+    """
+    sessions: Dict[str, HumanInDiscord] = {}
+    connections = set()
+    connection_ids = itertools.count(1)
+    
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        transport = StdioTransport.from_streams(reader, writer)
+        await transport.connect()
+        if len(connections) >= max_clients:
+            logging.warning("🚫 Refusing client: %s clients already connected", max_clients)
+            await transport.send({"jsonrpc": "2.0", "id": None,
+                                  "error": {"code": -32000, "message": f"Daemon is full ({max_clients} clients)"}})
+            await transport.close()
+            return
+        connections.add(transport)
+        try:
+            await serve_client(transport)
+        finally:
+            connections.discard(transport)
+    
+    async def serve_client(transport: StdioTransport) -> None:
+        # Optional session hello; anything else is the first JSON-RPC request
+        session = None
+        overrides = {}
+        try:
+            first = await transport.read_frame()
+        except FrameTooLarge as e:
+            await transport.send(e.error_response())
+            first = b""
+        if first:
+            try:
+                hello = json.loads(first)
+            except ValueError:
+                hello = None
+            if isinstance(hello, dict) and "jsonrpc" not in hello and hello.get("session"):
+                session = str(hello["session"])
+                for key in ("channel_id", "user_id"):
+                    if hello.get(key):
+                        overrides[key] = int(hello[key])
+                if hello.get("responder_ids"):
+                    overrides["responder_ids"] = [int(i) for i in hello["responder_ids"]]
+            else:
+                transport.pushback(first)
+        connection_id = next(connection_ids)
+        if session is None:
+            session = f"client-{connection_id}"
+        elif session in sessions:
+            session = f"{session}-{connection_id}"  # same name connected twice: keep their state apart
+        
+        human_handler = new_session(session, **overrides)
+        human_handler.restore()
+        sessions[session] = human_handler
+        metrics.set_gauge("daemon_sessions", len(sessions))
+        logging.info("🔌 Client connected: session '%s' (%s connected)", session, len(sessions))
+        try:
+            # A departed client cannot collect a 6-hour ask_human: answer quick requests, cancel the rest
+            await handle_stdin_input(MCPHandler(human_handler), max_concurrent_tool_calls, transport,
+                                     DAEMON_DRAIN_SECONDS)
+        except Exception as e:
+            logging.error("❌ Client session '%s' failed: %s", session, e)
+        finally:
+            await human_handler.close()
+            del sessions[session]
+            metrics.set_gauge("daemon_sessions", len(sessions))
+            logging.info("🔌 Client disconnected: session '%s' (%s connected)", session, len(sessions))
+    
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)  # stale socket from a previous run
+    server = await asyncio.start_unix_server(handle, socket_path, limit=STDIO_READ_LIMIT)
+    os.chmod(socket_path, 0o600)
+    logging.info("🛰️ Daemon listening on %s", socket_path)
+    return server
+
+async def run_shim(socket_path: str, session: str, **overrides) -> None:
+    """Relay stdin/stdout to a running daemon (--connect): no Discord login in this process"""
+    stdio = StdioTransport()
+    await stdio.connect()
+    reader, writer = await asyncio.open_unix_connection(socket_path, limit=STDIO_READ_LIMIT)
+    daemon = StdioTransport.from_streams(reader, writer)
+    await daemon.connect()
+    await daemon.send(dict({"session": session}, **{k: v for k, v in overrides.items() if v}))
+    
+    async def relay(source: StdioTransport, target: StdioTransport) -> None:
+        while True:
+            try:
+                frame = await source.read_frame()
+            except FrameTooLarge as e:
+                # Only our own stdin can overrun here (the daemon's frames fit its own limit)
+                await stdio.send(e.error_response())
+                continue
+            if frame is None:
+                return
+            if frame.strip():
+                await target.send_frame(frame if frame.endswith(b"\n") else frame + b"\n")
+    
+    async def upstream_then_eof() -> None:
+        await relay(stdio, daemon)
+        daemon.write_eof()  # the daemon answers what it has read, then closes
+    
+    upstream = asyncio.ensure_future(upstream_then_eof())
+    await relay(daemon, stdio)  # ends when the daemon closes the connection
+    if not upstream.done():
+        upstream.cancel()
+    await asyncio.gather(upstream, return_exceptions=True)
+    await daemon.close()
+    await stdio.close()
 
 async def main():
     """Main function - properly integrated like Rust tokio::select!"""
     parser = argparse.ArgumentParser(description="Human-in-the-loop MCP server")
-    parser.add_argument("--discord-channel-id", type=int, required=True)
-    parser.add_argument("--discord-user-id", type=int, required=True)
+    parser.add_argument("--discord-channel-id", type=int)
+    parser.add_argument("--discord-user-id", type=int)
+    parser.add_argument("--session-store", default=os.getenv("HUMAN_SESSION_STORE"),
+                        help="SQLite file used to keep the thread and pending questions across restarts")
+    parser.add_argument("--session", default=os.getenv("HUMAN_SESSION", "default"),
+                        help="Session name; one thread per (channel, user, session)")
+    parser.add_argument("--report-flush-seconds", type=float,
+                        default=float(os.getenv("REPORT_FLUSH_SECONDS", REPORT_FLUSH_SECONDS)),
+                        help="Window in which report_to_human messages are merged into one Discord message")
+    parser.add_argument("--report-queue-size", type=int,
+                        default=int(os.getenv("REPORT_QUEUE_SIZE", REPORT_QUEUE_SIZE)),
+                        help="Maximum number of queued reports")
+    parser.add_argument("--report-overflow", choices=REPORT_OVERFLOW_POLICIES,
+                        default=os.getenv("REPORT_OVERFLOW", "merge"),
+                        help="What to do when the report queue is full")
+    parser.add_argument("--history-max-messages", type=int,
+                        default=int(os.getenv("HISTORY_MAX_MESSAGES", HISTORY_MAX_MESSAGES)),
+                        help="Conversation entries kept in memory")
+    parser.add_argument("--history-max-bytes", type=int,
+                        default=int(os.getenv("HISTORY_MAX_BYTES", HISTORY_MAX_BYTES)),
+                        help="Bytes of conversation text kept in memory")
+    parser.add_argument("--history-log", default=os.getenv("HUMAN_HISTORY_LOG"),
+                        help="JSON-lines file receiving entries evicted from memory")
+    parser.add_argument("--attachment-threshold", type=int,
+                        default=int(os.getenv("ATTACHMENT_THRESHOLD_CHARS", ATTACHMENT_THRESHOLD_CHARS)),
+                        help="Messages longer than this many characters are sent as a file attachment")
+    parser.add_argument("--attachment-gzip-bytes", type=int,
+                        default=int(os.getenv("ATTACHMENT_GZIP_BYTES", ATTACHMENT_GZIP_BYTES)),
+                        help="Gzip attachments of at least this many bytes (0 disables compression)")
+    parser.add_argument("--title-keywords", default=os.getenv("TITLE_KEYWORDS_FILE"),
+                        help='JSON file {"tech": [...], "action": [...]} with keywords for fallback titles')
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("METRICS_PORT", "0")),
+                        help="Serve Prometheus metrics on 127.0.0.1:PORT (0 disables)")
+    parser.add_argument("--metrics-file", default=os.getenv("METRICS_FILE"),
+                        help="Periodically write Prometheus metrics to this file")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "INFO").upper(),
+                        choices=("DEBUG", "INFO", "WARNING", "ERROR"), help="Root log level")
+    parser.add_argument("--log-file", default=os.getenv("HUMAN_LOG_FILE"),
+                        help="Also write logs as JSON lines (with request and thread ids) to this rotating file")
+    parser.add_argument("--log-file-max-bytes", type=int,
+                        default=int(os.getenv("HUMAN_LOG_FILE_MAX_BYTES", LOG_FILE_MAX_BYTES)),
+                        help="Rotate the log file at this size")
+    parser.add_argument("--log-file-backups", type=int,
+                        default=int(os.getenv("HUMAN_LOG_FILE_BACKUPS", LOG_FILE_BACKUPS)),
+                        help="Rotated log files kept")
+    parser.add_argument("--max-concurrent-tool-calls", type=int,
+                        default=int(os.getenv("MCP_MAX_CONCURRENT_TOOL_CALLS", DEFAULT_MAX_CONCURRENT_TOOL_CALLS)),
+                        help="Maximum number of tools/call requests handled at the same time")
+    parser.add_argument("--ready-timeout", type=float,
+                        default=float(os.getenv("DISCORD_READY_TIMEOUT", DISCORD_READY_TIMEOUT_SECONDS)),
+                        help="Seconds a tool call waits for the Discord gateway before failing")
+    parser.add_argument("--responder-ids", type=lambda v: [int(i) for i in v.split(",") if i.strip()],
+                        default=[int(i) for i in os.getenv("HUMAN_RESPONDER_IDS", "").split(",") if i.strip()],
+                        help="Comma-separated extra Discord user IDs allowed to answer questions")
+    parser.add_argument("--reminder-intervals", type=lambda v: [float(i) for i in v.split(",") if i.strip()],
+                        default=os.getenv("HUMAN_REMINDER_INTERVALS",
+                                          ",".join(f"{i:g}" for i in DEFAULT_REMINDER_INTERVALS)),
+                        help="Comma-separated seconds after asking at which to mention the user again "
+                             "(empty disables reminders)")
+    parser.add_argument("--lean", action="store_true", default=os.getenv("HUMAN_LEAN", "") not in ("", "0"),
+                        help="Minimal gateway intents and no message/member caches (lower memory)")
+    parser.add_argument("--daemon", metavar="SOCKET", default=os.getenv("HUMAN_DAEMON_SOCKET"),
+                        help="Run as a shared daemon serving MCP clients on this Unix socket")
+    parser.add_argument("--daemon-max-clients", type=int,
+                        default=int(os.getenv("HUMAN_DAEMON_MAX_CLIENTS", DAEMON_MAX_CLIENTS)),
+                        help="Maximum number of clients connected to the daemon at once")
+    parser.add_argument("--connect", metavar="SOCKET", default=os.getenv("HUMAN_CONNECT_SOCKET"),
+                        help="Relay this MCP session to a daemon instead of logging in to Discord")
     
     args = parser.parse_args()
+    if args.report_queue_size < 1:
+        parser.error("--report-queue-size must be at least 1")
+    configure_logging(args.log_level, args.log_file, args.log_file_max_bytes, args.log_file_backups)
+    
+    # Thin client: everything Discord-related lives in the daemon
+    if args.connect:
+        try:
+            await run_shim(args.connect, args.session, channel_id=args.discord_channel_id,
+                           user_id=args.discord_user_id, responder_ids=args.responder_ids)
+        except OSError as e:
+            logging.error("❌ Cannot reach daemon at %s: %s", args.connect, e)
+            sys.exit(1)
+        return
+    
+    if args.discord_channel_id is None or args.discord_user_id is None:
+        parser.error("--discord-channel-id and --discord-user-id are required (unless --connect is used)")
     
     # Get Discord token
     discord_token = os.getenv("DISCORD_TOKEN")
@@ -509,33 +3216,70 @@ async def main():
         logging.error("❌ DISCORD_TOKEN environment variable is required")
         sys.exit(1)
     
-    logging.info(f"🎯 Starting with channel_id={args.discord_channel_id}, user_id={args.discord_user_id}")
+    logging.info("🎯 Starting with channel_id=%s, user_id=%s", args.discord_channel_id, args.discord_user_id)
+    
+    question_deadlines.reminders = tuple(sorted(args.reminder_intervals))
     
     # Create Discord bot
-    bot = HumanInTheLoopBot(args.discord_channel_id, args.discord_user_id)
+    bot = HumanInTheLoopBot(lean=args.lean)
     
-    # Create human handler
-    human_handler = HumanInDiscord(bot, args.discord_channel_id, args.discord_user_id)
+    # Create human handler (one per session; the daemon makes one per client)
+    title_keywords = load_title_keywords(args.title_keywords)
     
-    # Create MCP handler
-    mcp_handler = MCPHandler(human_handler)
+    def new_session(session: str, channel_id: Optional[int] = None, user_id: Optional[int] = None,
+                    responder_ids=None) -> HumanInDiscord:
+        channel_id = channel_id or args.discord_channel_id
+        user_id = user_id or args.discord_user_id
+        store = None
+        if args.session_store:
+            store = SessionStore(args.session_store, channel_id, user_id, session)
+        history_log = args.history_log
+        if history_log and args.daemon:
+            history_log = f"{history_log}.{session}"  # one spill file per client
+        return HumanInDiscord(bot, channel_id, user_id, store,
+                              report_flush_seconds=args.report_flush_seconds,
+                              report_queue_size=args.report_queue_size,
+                              report_overflow=args.report_overflow,
+                              history=ConversationHistory(args.history_max_messages, args.history_max_bytes,
+                                                          history_log),
+                              attachment_threshold=args.attachment_threshold,
+                              attachment_gzip_bytes=args.attachment_gzip_bytes,
+                              title_keywords=title_keywords,
+                              ready_timeout=args.ready_timeout,
+                              responder_ids=args.responder_ids if responder_ids is None else responder_ids)
     
     # Store bot globally for access
     global discord_client
     discord_client = bot
     
+    # Optional metrics exposure (the MCP `stats` tool is always available)
+    if args.metrics_port:
+        await serve_metrics(args.metrics_port)
+    if args.metrics_file:
+        asyncio.ensure_future(dump_metrics_periodically(args.metrics_file))
+    
     # Run both Discord bot and stdin handler concurrently
     # This mimics Rust's tokio::select! behavior
     try:
+        if args.daemon:
+            logging.info("🚀 Starting Discord bot and MCP daemon")
+            await serve_daemon(args.daemon, new_session, args.daemon_max_clients, args.max_concurrent_tool_calls)
+            await bot.start(discord_token)
+            return
+        
+        human_handler = new_session(args.session)
+        human_handler.restore()
+        mcp_handler = MCPHandler(human_handler)
+        
         logging.info("🚀 Starting Discord bot and MCP stdin handler")
         await asyncio.gather(
             bot.start(discord_token),
-            handle_stdin_input(mcp_handler)
+            handle_stdin_input(mcp_handler, args.max_concurrent_tool_calls)
         )
     except KeyboardInterrupt:
         logging.info("🛑 Shutting down...")
     except Exception as e:
-        logging.error(f"❌ Error: {e}")
+        logging.error("❌ Error: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":